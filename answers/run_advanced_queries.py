@@ -11,19 +11,17 @@ def main():
         print("\n=== QUERY 1: Top 5 Crescimento de Despesas ===")
         q1 = """
         WITH periodos AS (
-            SELECT MIN(trimestre) as inicio, MAX(trimestre) as fim FROM despesas
+            SELECT MIN(trimestre) as inicio, MAX(trimestre) as fim FROM mv_despesas_operadora_trimestre
         ),
         despesas_inicio AS (
-            SELECT registro_ans, SUM(valor_despesas) as total_ini
-            FROM despesas, periodos
+            SELECT registro_ans, total_despesas as total_ini
+            FROM mv_despesas_operadora_trimestre, periodos
             WHERE trimestre = periodos.inicio
-            GROUP BY registro_ans
         ),
         despesas_fim AS (
-            SELECT registro_ans, SUM(valor_despesas) as total_fim
-            FROM despesas, periodos
+            SELECT registro_ans, total_despesas as total_fim
+            FROM mv_despesas_operadora_trimestre, periodos
             WHERE trimestre = periodos.fim
-            GROUP BY registro_ans
         )
         SELECT 
             o.razao_social,
@@ -42,13 +40,11 @@ def main():
         print("\n=== QUERY 2: Top 5 Estados (Total e Media por Operadora) ===")
         q2 = """
         SELECT 
-            o.uf,
-            SUM(d.valor_despesas) as despesas_totais,
-            COUNT(DISTINCT d.registro_ans) as qtd_operadoras,
-            ROUND(SUM(d.valor_despesas) / COUNT(DISTINCT d.registro_ans), 2) as media_por_operadora
-        FROM despesas d
-        JOIN operadoras o ON d.registro_ans = o.registro_ans
-        GROUP BY o.uf
+            uf,
+            despesas_totais,
+            qtd_operadoras,
+            ROUND(despesas_totais / qtd_operadoras, 2) as media_por_operadora
+        FROM mv_despesas_uf
         ORDER BY despesas_totais DESC
         LIMIT 5;
         """
@@ -61,10 +57,9 @@ def main():
             SELECT 
                 registro_ans,
                 trimestre,
-                SUM(valor_despesas) as despesa_operadora,
-                AVG(SUM(valor_despesas)) OVER(PARTITION BY trimestre) as media_geral_trimestre
-            FROM despesas
-            GROUP BY registro_ans, trimestre
+                total_despesas as despesa_operadora,
+                AVG(total_despesas) OVER(PARTITION BY trimestre) as media_geral_trimestre
+            FROM mv_despesas_operadora_trimestre
         ),
         operadoras_acima AS (
             SELECT registro_ans
@@ -1,26 +1,72 @@
-import pandas as pd
+import numpy as np
 import zipfile
 import sys
 import os
+from storage import FORMAT, frame_exists, write_frame
+from schema import apply_schema, concat_frames, read_typed
+from manifest import INCREMENTAL, load_manifest
+from metrics import count_rows, instrumented
 
 INPUT_FILE = os.path.join("output", "consolidado_despesas_enriquecido.csv")
 OUTPUT_FILE = os.path.join("output", "despesas_agregadas.csv")
+QUARTER_FILE = os.path.join("output", "despesas_por_trimestre.csv")
+MODALITY_FILE = os.path.join("output", "despesas_por_modalidade.csv")
+STATE_FILE = os.path.join("output", "estado_agregados.csv")
 ZIP_FILE = os.path.join("output", "Teste_LuizFelipe.zip")
+STATE_KEYS = ['RazaoSocial', 'UF', 'Modalidade', 'Trimestre']
 
-def main():
-    try:
-        df = pd.read_csv(INPUT_FILE)
-    except FileNotFoundError:
-        sys.exit(1)
+def partial_state(df):
+    grupos = df.groupby(STATE_KEYS, observed=True, dropna=False)['ValorDespesas']
+    estado = grupos.agg(Quantidade='count', Soma='sum', Media='mean')
+    estado['M2'] = grupos.var(ddof=0) * estado['Quantidade']
+    return apply_schema(estado.reset_index())
 
-    agg_df = df.groupby(['RazaoSocial', 'UF'])['ValorDespesas'].agg(
-        TotalDespesas='sum',
-        MediaTrimestral='mean',
-        DesvioPadrao='std'
+def combine_state(estado, keys):
+    parciais = estado[keys + ['Quantidade', 'Soma', 'Media', 'M2']].copy()
+    grupos = parciais.groupby(keys, observed=True)
+    media_grupo = grupos['Soma'].transform('sum') / grupos['Quantidade'].transform('sum')
+    parciais['M2'] = parciais['M2'].fillna(0) + (parciais['Quantidade'] * (parciais['Media'] - media_grupo) ** 2).fillna(0)
+
+    agg_df = parciais.groupby(keys, observed=True).agg(
+        Quantidade=('Quantidade', 'sum'),
+        TotalDespesas=('Soma', 'sum'),
+        M2=('M2', 'sum')
     ).reset_index()
+    agg_df['Media'] = agg_df['TotalDespesas'] / agg_df['Quantidade']
+    agg_df['DesvioPadrao'] = np.sqrt(agg_df['M2'] / (agg_df['Quantidade'] - 1)).where(agg_df['Quantidade'] > 1)
+    return agg_df
 
-    agg_df.sort_values(by='TotalDespesas', ascending=False, inplace=True)
-    agg_df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
+def update_state(incremental=INCREMENTAL):
+    alterados = None
+    if incremental and frame_exists(STATE_FILE):
+        alterados = load_manifest()['trimestres_alterados']
+        if not alterados:
+            return None
+
+    df = read_typed(INPUT_FILE, trimestres=alterados)
+    count_rows(entrada=len(df))
+    estado = partial_state(df)
+
+    if alterados is not None:
+        print(f"Modo incremental: agregando {len(df)} linha(s) de {len(alterados)} trimestre(s)")
+        antigo = read_typed(STATE_FILE)
+        estado = concat_frames([antigo[~antigo['Trimestre'].isin(alterados)].copy(), estado])
+
+    write_frame(estado, STATE_FILE)
+    return estado
+
+def write_deliverable(agg_df):
+    conteudo = agg_df.to_csv(index=False)
+    if os.path.exists(OUTPUT_FILE) and os.path.exists(ZIP_FILE) and frame_exists(OUTPUT_FILE):
+        with open(OUTPUT_FILE, encoding='utf-8', newline='') as f:
+            if f.read() == conteudo:
+                print("Agregados inalterados")
+                return
+
+    with open(OUTPUT_FILE, 'w', encoding='utf-8', newline='') as f:
+        f.write(conteudo)
+    if FORMAT != 'csv':
+        write_frame(agg_df, OUTPUT_FILE)
 
     if os.path.exists(ZIP_FILE):
         os.remove(ZIP_FILE)
@@ -28,5 +74,30 @@ def main():
     with zipfile.ZipFile(ZIP_FILE, 'w', zipfile.ZIP_DEFLATED) as z:
         z.write(OUTPUT_FILE, arcname="despesas_agregadas.csv")
 
+@instrumented("aggregate")
+def main(incremental=INCREMENTAL):
+    try:
+        estado = update_state(incremental)
+    except FileNotFoundError:
+        sys.exit(1)
+
+    if estado is None:
+        print("Nenhum trimestre alterado para agregar")
+        return
+
+    agg_df = combine_state(estado, ['RazaoSocial', 'UF'])
+    agg_df = agg_df[['RazaoSocial', 'UF', 'TotalDespesas', 'Media', 'DesvioPadrao']].rename(columns={'Media': 'MediaTrimestral'})
+    agg_df.sort_values(by='TotalDespesas', ascending=False, inplace=True)
+    count_rows(saida=len(agg_df))
+    write_deliverable(agg_df)
+
+    colunas = ['TotalDespesas', 'Media', 'DesvioPadrao', 'Quantidade']
+    por_trimestre = combine_state(estado, ['Trimestre'])[['Trimestre'] + colunas]
+    write_frame(por_trimestre.rename(columns={'Media': 'MediaDespesas', 'Quantidade': 'QtdLancamentos'}), QUARTER_FILE)
+
+    por_modalidade = combine_state(estado, ['Modalidade'])[['Modalidade'] + colunas]
+    por_modalidade = por_modalidade.sort_values(by='TotalDespesas', ascending=False)
+    write_frame(por_modalidade.rename(columns={'Media': 'MediaDespesas', 'Quantidade': 'QtdLancamentos'}), MODALITY_FILE)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,10 +1,158 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, text
-from typing import Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import List, Optional
+from pydantic import BaseModel, Field
 import os
+import io
+import csv
+import json
+import base64
+import threading
+import re
+import time
+import hashlib
+import bisect
+from datetime import date
 
-app = FastAPI()
+DB_URL = os.getenv("DB_URL", "postgresql://postgres:ans_password@db:5432/postgres")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+engine = create_async_engine(
+    make_url(DB_URL).set(drivername="postgresql+asyncpg"),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    connect_args={'server_settings': {'statement_timeout': str(DB_STATEMENT_TIMEOUT_MS)}},
+)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_histograms = {}
+_counters = {}
+_in_flight = {'valor': 0}
+
+def observe(metric, labels, value):
+    serie = _histograms.get((metric, labels))
+    if serie is None:
+        serie = _histograms[(metric, labels)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+    serie[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    serie[1] += value
+
+def increment(metric, labels=()):
+    _counters[(metric, labels)] = _counters.get((metric, labels), 0) + 1
+
+def query_labels(context):
+    opcoes = context.execution_options if context is not None else {}
+    return (('query', opcoes.get('query_name', 'outra')),)
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['inicio_consulta'] = time.perf_counter()
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    observe('ans_api_db_query_duration_seconds', query_labels(context), time.perf_counter() - conn.info['inicio_consulta'])
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def handle_error(context):
+    increment('ans_api_db_query_errors_total', query_labels(context.execution_context))
+
+@asynccontextmanager
+async def connect():
+    inicio = time.perf_counter()
+    async with engine.connect() as conn:
+        observe('ans_api_db_pool_wait_seconds', (), time.perf_counter() - inicio)
+        yield conn
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = {'codigo': 500}
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['codigo'] = message['status']
+            await send(message)
+
+        inicio = time.perf_counter()
+        _in_flight['valor'] += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_flight['valor'] -= 1
+            route = scope.get('route')
+            endpoint = scope.get('endpoint')
+            nome = getattr(route, 'path', None) or getattr(endpoint, '__name__', 'desconhecida')
+            labels = (('method', scope['method']), ('route', nome), ('status', str(status['codigo'])))
+            observe('ans_api_request_duration_seconds', labels, time.perf_counter() - inicio)
+
+def format_labels(labels, **extra):
+    pares = list(labels) + list(extra.items())
+    if not pares:
+        return ''
+    escape = lambda valor: str(valor).replace('\\', '\\\\').replace('"', '\\"')
+    return '{' + ','.join(f'{nome}="{escape(valor)}"' for nome, valor in pares) + '}'
+
+def prometheus_text():
+    linhas = []
+    ajuda = {
+        'ans_api_request_duration_seconds': 'Latencia das requisicoes HTTP por rota',
+        'ans_api_db_query_duration_seconds': 'Tempo de execucao das consultas SQL por consulta',
+        'ans_api_db_pool_wait_seconds': 'Tempo de espera para obter uma conexao do pool',
+    }
+    for metric, descricao in ajuda.items():
+        linhas += [f"# HELP {metric} {descricao}", f"# TYPE {metric} histogram"]
+        for (nome, labels), (contagens, soma) in list(_histograms.items()):
+            if nome != metric: continue
+            acumulado = 0
+            for limite, contagem in zip(LATENCY_BUCKETS + ('+Inf',), contagens):
+                acumulado += contagem
+                linhas.append(f"{metric}_bucket{format_labels(labels, le=limite)} {acumulado}")
+            linhas.append(f"{metric}_sum{format_labels(labels)} {soma}")
+            linhas.append(f"{metric}_count{format_labels(labels)} {acumulado}")
+
+    for metric, descricao in (('ans_api_db_query_errors_total', 'Consultas SQL que falharam'),
+                              ('ans_api_db_pool_timeouts_total', 'Requisicoes sem conexao disponivel no pool')):
+        linhas += [f"# HELP {metric} {descricao}", f"# TYPE {metric} counter"]
+        for (nome, labels), valor in list(_counters.items()):
+            if nome == metric:
+                linhas.append(f"{metric}{format_labels(labels)} {valor}")
+
+    pool = engine.pool
+    gauges = {
+        'ans_api_requests_in_flight': ('Requisicoes HTTP em andamento', _in_flight['valor']),
+        'ans_api_db_pool_size': ('Tamanho configurado do pool', pool.size()),
+        'ans_api_db_pool_checked_out': ('Conexoes do pool em uso', pool.checkedout()),
+        'ans_api_db_pool_overflow': ('Conexoes abertas alem do tamanho do pool', max(pool.overflow(), 0)),
+    }
+    for metric, (descricao, valor) in gauges.items():
+        linhas += [f"# HELP {metric} {descricao}", f"# TYPE {metric} gauge", f"{metric} {valor}"]
+    return "\n".join(linhas) + "\n"
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 app.add_middleware(
@@ -13,92 +161,426 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(MetricsMiddleware)
 
-DB_URL = os.getenv("DB_URL", "postgresql://postgres:ans_password@db:5432/postgres")
-engine = create_engine(DB_URL)
+TOTALS_CACHE_SIZE = 1024
+AUTOCOMPLETE_MAX_LIMIT = 50
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+EXPORT_MAX_LIMIT = 1000
+EXPORT_COLUMNS = ('id', 'ano', 'trimestre', 'conta', 'descricao', 'valor_despesas')
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+OPERADORA_COLUMNS = ('registro_ans', 'cnpj', 'razao_social', 'modalidade', 'uf')
+_totals_cache = {'geracao': None, 'totais': {}}
+_totals_lock = threading.Lock()
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+GENERATION_TTL = float(os.getenv("CACHE_GENERATION_TTL", "5"))
+_response_cache = OrderedDict()
+_response_cache_bytes = {'total': 0}
+_generation = {'valor': None, 'verificado_em': 0.0}
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request, exc):
+    increment('ans_api_db_pool_timeouts_total')
+    return JSONResponse(status_code=503, content={"detail": "Banco de dados sobrecarregado, tente novamente"})
+
+def encode_cursor(direction, registro_ans):
+    payload = json.dumps({direction: int(registro_ans)}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        (direction, registro_ans), = json.loads(payload).items()
+        if direction not in ('after', 'before'): raise ValueError(direction)
+        return direction, int(registro_ans)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor invalido")
+
+def like_escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+async def data_generation(conn):
+    return (await conn.execute(text("SELECT geracao FROM controle_carga WHERE id = 1").execution_options(query_name='geracao_carga'))).scalar() or 0
+
+async def current_generation(conn=None):
+    if _generation['valor'] is None or time.monotonic() - _generation['verificado_em'] > GENERATION_TTL:
+        if conn is None:
+            async with connect() as conn:
+                _generation['valor'] = await data_generation(conn)
+        else:
+            _generation['valor'] = await data_generation(conn)
+        _generation['verificado_em'] = time.monotonic()
+    return _generation['valor']
+
+def cache_body(chave, body):
+    if len(body) > RESPONSE_CACHE_MAX_ENTRY_BYTES or chave in _response_cache:
+        return
+    _response_cache[chave] = body
+    _response_cache_bytes['total'] += len(body)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE or _response_cache_bytes['total'] > RESPONSE_CACHE_MAX_BYTES:
+        _, antigo = _response_cache.popitem(last=False)
+        _response_cache_bytes['total'] -= len(antigo)
+
+async def cached_response(request, producer):
+    key = str(request.url.path) + ('?' + request.url.query if request.url.query else '')
+    generation = await current_generation()
+    etag = f'"{generation}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    if etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    body = _response_cache.get((key, generation))
+    if body is None:
+        body = json.dumps(jsonable_encoder(await producer()), ensure_ascii=False).encode('utf-8')
+        cache_body((key, generation), body)
+    else:
+        _response_cache.move_to_end((key, generation))
+
+    return Response(content=body, media_type='application/json', headers=headers)
+
+async def cached_total(conn, where_clause, params, search):
+    generation = await current_generation(conn)
+    with _totals_lock:
+        if _totals_cache['geracao'] != generation:
+            _totals_cache['geracao'] = generation
+            _totals_cache['totais'].clear()
+        total = _totals_cache['totais'].get(search)
+    if total is not None:
+        return total
+
+    total = (await conn.execute(text(f"SELECT COUNT(*) FROM operadoras {where_clause}").execution_options(query_name='operadoras_total'), params)).scalar()
+    with _totals_lock:
+        totais = _totals_cache['totais']
+        if len(totais) >= TOTALS_CACHE_SIZE:
+            totais.pop(next(iter(totais)))
+        totais[search] = total
+    return total
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=prometheus_text(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.get("/api/operadoras")
-def list_operadoras(page: int = 1, limit: int = 10, search: Optional[str] = None):
-    offset = (page - 1) * limit
-    params = {'limit': limit, 'offset': offset}
+async def list_operadoras(page: Optional[int] = None, limit: int = 10, search: Optional[str] = None,
+                    cursor: Optional[str] = None, include_total: bool = True):
+    if cursor and page is not None:
+        raise HTTPException(status_code=400, detail="Use page ou cursor, nao ambos")
+    page = page or 1
+    params = {'limit': limit + 1}
     
     base_where = "WHERE cnpj IS NOT NULL AND cnpj != ''"
     
     if search:
-        where_clause = f"{base_where} AND (razao_social ILIKE :search OR cnpj ILIKE :search)"
-        params['search'] = f"%{search}%"
+        where_clause = f"{base_where} AND (f_unaccent(razao_social) ILIKE f_unaccent(:search) OR cnpj ILIKE :search)"
+        params['search'] = f"%{like_escape(search)}%"
     else:
         where_clause = base_where
+
+    direction = None
+    if cursor:
+        direction, params['reg'] = decode_cursor(cursor)
+        op, order = ('>', 'ASC') if direction == 'after' else ('<', 'DESC')
+        query_data = text(f"""
+            SELECT registro_ans, cnpj, razao_social, modalidade, uf 
+            FROM operadoras 
+            {where_clause} AND registro_ans {op} :reg
+            ORDER BY registro_ans {order}
+            LIMIT :limit
+        """).execution_options(query_name='operadoras_pagina')
+    else:
+        params['offset'] = (page - 1) * limit
+        query_data = text(f"""
+            SELECT registro_ans, cnpj, razao_social, modalidade, uf 
+            FROM operadoras 
+            {where_clause}
+            ORDER BY registro_ans
+            LIMIT :limit OFFSET :offset
+        """).execution_options(query_name='operadoras_pagina')
     
-    query_total = text(f"SELECT COUNT(*) FROM operadoras {where_clause}")
-    query_data = text(f"""
-        SELECT registro_ans, cnpj, razao_social, modalidade, uf 
-        FROM operadoras 
-        {where_clause}
-        ORDER BY registro_ans
-        LIMIT :limit OFFSET :offset
-    """)
-    
-    with engine.connect() as conn:
-        total = conn.execute(query_total, params).scalar()
-        result = conn.execute(query_data, params).mappings().all()
-        
-    return {
+    async with connect() as conn:
+        total = await cached_total(conn, where_clause, params, search or '') if include_total else None
+        result = (await conn.execute(query_data, params)).mappings().all()
+
+    has_more = len(result) > limit
+    result = result[:limit]
+    if direction == 'before':
+        result = result[::-1]
+
+    if direction == 'before':
+        has_next, has_prev = True, has_more
+    elif direction == 'after':
+        has_next, has_prev = has_more, True
+    else:
+        has_next, has_prev = has_more, page > 1
+
+    resposta = {
         "data": result,
         "page": page,
         "limit": limit,
-        "total": total
+        "total": total,
+        "next_cursor": encode_cursor('after', result[-1]['registro_ans']) if result and has_next else None,
+        "prev_cursor": encode_cursor('before', result[0]['registro_ans']) if result and has_prev else None
     }
+    if direction:
+        del resposta['page']
+    return resposta
+
+def normalize_cnpj(cnpj):
+    digits = re.sub(r'\D', '', cnpj)
+    return digits.zfill(14) if digits else digits
+
+class BatchLookup(BaseModel):
+    cnpjs: List[str] = Field(default_factory=list, max_length=BATCH_MAX_ITEMS)
+    registros_ans: List[int] = Field(default_factory=list, max_length=BATCH_MAX_ITEMS)
+    incluir_despesas: bool = False
+
+@app.post("/api/operadoras/batch")
+async def batch_operadoras(lote: BatchLookup):
+    cnpjs = {}
+    for original in lote.cnpjs:
+        cnpjs.setdefault(normalize_cnpj(original), []).append(original)
+    registros = sorted(set(lote.registros_ans))
+    if not cnpjs and not registros:
+        raise HTTPException(status_code=400, detail="Informe cnpjs ou registros_ans")
+
+    if lote.incluir_despesas:
+        query = text(f"""
+            SELECT {', '.join('o.' + col for col in OPERADORA_COLUMNS)},
+                   m.trimestre, m.total_despesas, m.qtd_lancamentos
+            FROM operadoras o
+            LEFT JOIN mv_despesas_operadora_trimestre m ON m.registro_ans = o.registro_ans
+            WHERE o.cnpj = ANY(:cnpjs) OR o.registro_ans = ANY(:registros)
+            ORDER BY o.registro_ans, m.trimestre
+        """).execution_options(query_name='operadoras_batch_despesas')
+    else:
+        query = text(f"""
+            SELECT {', '.join(OPERADORA_COLUMNS)}
+            FROM operadoras
+            WHERE cnpj = ANY(:cnpjs) OR registro_ans = ANY(:registros)
+            ORDER BY registro_ans
+        """).execution_options(query_name='operadoras_batch')
+
+    async with connect() as conn:
+        rows = (await conn.execute(query, {'cnpjs': list(cnpjs), 'registros': registros})).mappings().all()
+
+    operadoras = {}
+    for row in rows:
+        operadora = operadoras.get(row['registro_ans'])
+        if operadora is None:
+            operadora = operadoras[row['registro_ans']] = {col: row[col] for col in OPERADORA_COLUMNS}
+            if lote.incluir_despesas:
+                operadora['despesas_trimestrais'] = []
+        if lote.incluir_despesas and row['trimestre'] is not None:
+            operadora['despesas_trimestrais'].append({
+                'trimestre': row['trimestre'],
+                'total_despesas': row['total_despesas'],
+                'qtd_lancamentos': row['qtd_lancamentos'],
+            })
+
+    por_cnpj = {operadora['cnpj']: registro for registro, operadora in operadoras.items()}
+    return {
+        "data": list(operadoras.values()),
+        "cnpjs": {original: por_cnpj[cnpj] for cnpj, originais in cnpjs.items() if cnpj in por_cnpj for original in originais},
+        "nao_encontrados": {
+            "cnpjs": [original for cnpj, originais in cnpjs.items() if cnpj not in por_cnpj for original in originais],
+            "registros_ans": [registro for registro in registros if registro not in operadoras],
+        }
+    }
+
+@app.get("/api/operadoras/autocomplete")
+async def autocomplete_operadoras(q: str, limit: int = 10):
+    termo = q.strip()
+    if not termo:
+        return []
+
+    params = {
+        'termo': termo,
+        'contem': f"%{like_escape(termo)}%",
+        'prefixo': f"{like_escape(termo)}%",
+        'limit': min(limit, AUTOCOMPLETE_MAX_LIMIT)
+    }
+    conditions = ["f_unaccent(razao_social) ILIKE f_unaccent(:contem)", "f_unaccent(razao_social) % f_unaccent(:termo)"]
+    score_cnpj = "0"
+
+    digits = re.sub(r'\D', '', termo)
+    if digits and re.fullmatch(r'[\d./\-\s]+', termo):
+        params['cnpj_prefixo'] = f"{digits}%"
+        conditions.append("cnpj LIKE :cnpj_prefixo")
+        score_cnpj = "CASE WHEN cnpj LIKE :cnpj_prefixo THEN 2 ELSE 0 END"
+
+    query = text(f"""
+        SELECT registro_ans, cnpj, razao_social, modalidade, uf,
+               {score_cnpj}
+               + CASE WHEN f_unaccent(razao_social) ILIKE f_unaccent(:prefixo) THEN 1 ELSE 0 END
+               + similarity(f_unaccent(razao_social), f_unaccent(:termo)) AS score
+        FROM operadoras
+        WHERE cnpj IS NOT NULL AND cnpj != '' AND ({' OR '.join(conditions)})
+        ORDER BY score DESC, razao_social
+        LIMIT :limit
+    """).execution_options(query_name='operadoras_autocomplete')
+
+    async with connect() as conn:
+        return (await conn.execute(query, params)).mappings().all()
 
 @app.get("/api/operadoras/{cnpj}")
-def get_operadora(cnpj: str):
-    query = text("SELECT * FROM operadoras WHERE cnpj = :cnpj")
-    with engine.connect() as conn:
-        result = conn.execute(query, {'cnpj': cnpj}).mappings().one_or_none()
+async def get_operadora(cnpj: str, request: Request):
+    return await cached_response(request, lambda: fetch_operadora(cnpj))
+
+async def fetch_operadora(cnpj):
+    query = text("SELECT * FROM operadoras WHERE cnpj = :cnpj").execution_options(query_name='operadora')
+    async with connect() as conn:
+        result = (await conn.execute(query, {'cnpj': cnpj})).mappings().one_or_none()
     
     if not result:
         raise HTTPException(status_code=404, detail="Operadora nao encontrada")
     return result
 
 @app.get("/api/operadoras/{cnpj}/despesas")
-def get_operadora_despesas(cnpj: str):
-    q_reg = text("SELECT registro_ans FROM operadoras WHERE cnpj = :cnpj")
+async def get_operadora_despesas(cnpj: str, request: Request):
+    return await cached_response(request, lambda: fetch_operadora_despesas(cnpj))
+
+async def fetch_operadora_despesas(cnpj):
+    query = text("""
+        SELECT d.registro_ans IS NOT NULL AS possui_despesa,
+               d.ano, d.trimestre, d.conta, d.descricao, d.valor_despesas
+        FROM operadoras o
+        LEFT JOIN despesas d ON d.registro_ans = o.registro_ans
+        WHERE o.cnpj = :cnpj
+        ORDER BY d.ano DESC, d.trimestre DESC
+    """).execution_options(query_name='operadora_despesas')
     
-    with engine.connect() as conn:
-        reg = conn.execute(q_reg, {'cnpj': cnpj}).scalar()
-        
-        if not reg:
-            raise HTTPException(status_code=404, detail="Operadora nao encontrada")
-            
-        q_desp = text("""
-            SELECT ano, trimestre, conta, descricao, valor_despesas 
-            FROM despesas 
-            WHERE registro_ans = :reg
-            ORDER BY ano DESC, trimestre DESC
-        """)
-        despesas = conn.execute(q_desp, {'reg': reg}).mappings().all()
-        
-    return despesas
+    async with connect() as conn:
+        rows = (await conn.execute(query, {'cnpj': cnpj})).mappings().all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="Operadora nao encontrada")
+
+    campos = ('ano', 'trimestre', 'conta', 'descricao', 'valor_despesas')
+    return [{campo: row[campo] for campo in campos} for row in rows if row['possui_despesa']]
 
 @app.get("/api/estatisticas")
-def get_estatisticas():
-    q_total = text("SELECT SUM(valor_despesas) FROM despesas")
-    q_media = text("SELECT AVG(valor_despesas) FROM despesas")
+async def get_estatisticas(request: Request):
+    return await cached_response(request, fetch_estatisticas)
+
+async def fetch_estatisticas():
+    q_stats = text("SELECT total_despesas, media_despesas FROM mv_estatisticas").execution_options(query_name='estatisticas')
     q_top5 = text("""
         SELECT razao_social, total_despesas 
         FROM despesas_agregadas 
         ORDER BY total_despesas DESC 
         LIMIT 5
-    """)
+    """).execution_options(query_name='estatisticas_top5')
     
-    with engine.connect() as conn:
-        total = conn.execute(q_total).scalar()
-        media = conn.execute(q_media).scalar()
-        top5 = conn.execute(q_top5).mappings().all()
+    async with connect() as conn:
+        stats = (await conn.execute(q_stats)).mappings().one_or_none() or {}
+        top5 = (await conn.execute(q_top5)).mappings().all()
         
     return {
-        "total_despesas": total,
-        "media_despesas": media,
+        "total_despesas": stats.get('total_despesas'),
+        "media_despesas": stats.get('media_despesas'),
         "top_5_operadoras": top5
-    }
\ No newline at end of file
+    }
+
+def quarter_range(ano, trimestre=None):
+    if trimestre is None:
+        return date(ano, 1, 1), date(ano + 1, 1, 1)
+    inicio = date(ano, 3 * trimestre - 2, 1)
+    return inicio, date(ano + 1, 1, 1) if trimestre == 4 else date(ano, 3 * trimestre + 1, 1)
+
+def export_filters(cnpj, ano, trimestre, conta):
+    conditions = ["d.registro_ans = o.registro_ans"]
+    params = {'cnpj': cnpj}
+    if ano is not None:
+        conditions.append("d.trimestre >= :inicio AND d.trimestre < :fim")
+        params['inicio'], params['fim'] = quarter_range(ano, trimestre)
+    elif trimestre is not None:
+        conditions.append("EXTRACT(QUARTER FROM d.trimestre) = :trimestre")
+        params['trimestre'] = trimestre
+    if conta:
+        conditions.append("d.conta LIKE :conta")
+        params['conta'] = f"{like_escape(conta)}%"
+    return conditions, params
+
+def export_query(conditions, query_name, limit=False):
+    return text(f"""
+        SELECT d.id IS NOT NULL AS possui_despesa, {', '.join('d.' + c for c in EXPORT_COLUMNS)}
+        FROM operadoras o
+        LEFT JOIN despesas d ON {' AND '.join(conditions)}
+        WHERE o.cnpj = :cnpj
+        ORDER BY d.id
+        {'LIMIT :limit' if limit else ''}
+    """).execution_options(query_name=query_name)
+
+def serialize_batch(rows, formato):
+    rows = [row[1:] for row in rows if row[0]]
+    if formato == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return ''.join(
+        json.dumps(jsonable_encoder(dict(zip(EXPORT_COLUMNS, row))), ensure_ascii=False) + '\n' for row in rows
+    )
+
+async def stream_despesas(conditions, params, formato):
+    query = export_query(conditions, 'export_despesas')
+    encontrada = False
+
+    async with connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS), params)
+        async for rows in result.partitions():
+            if not encontrada:
+                encontrada = True
+                if formato == 'csv':
+                    yield ','.join(EXPORT_COLUMNS) + '\n'
+            yield serialize_batch(rows, formato)
+
+    if not encontrada:
+        raise HTTPException(status_code=404, detail="Operadora nao encontrada")
+
+async def prepend(primeiro, resto):
+    try:
+        yield primeiro
+        async for parte in resto:
+            yield parte
+    finally:
+        await resto.aclose()
+
+@app.get("/api/operadoras/{cnpj}/despesas/export")
+async def export_operadora_despesas(cnpj: str, formato: str = Query('ndjson', pattern='^(ndjson|csv|json)$'),
+                                    ano: Optional[int] = Query(None, ge=1900, le=2999), trimestre: Optional[int] = Query(None, ge=1, le=4),
+                                    conta: Optional[str] = None, cursor: Optional[str] = None,
+                                    limit: int = Query(100, ge=1, le=EXPORT_MAX_LIMIT)):
+    conditions, params = export_filters(cnpj, ano, trimestre, conta)
+
+    if formato == 'json':
+        if cursor:
+            direction, params['after'] = decode_cursor(cursor)
+            if direction != 'after':
+                raise HTTPException(status_code=400, detail="A exportacao so aceita cursores 'after'")
+            conditions.append("d.id > :after")
+        params['limit'] = limit + 1
+        async with connect() as conn:
+            rows = (await conn.execute(export_query(conditions, 'export_despesas_pagina', limit=True), params)).mappings().all()
+        if not rows:
+            raise HTTPException(status_code=404, detail="Operadora nao encontrada")
+
+        rows = [{campo: row[campo] for campo in EXPORT_COLUMNS} for row in rows if row['possui_despesa']]
+        return {
+            "data": rows[:limit],
+            "limit": limit,
+            "next_cursor": encode_cursor('after', rows[limit - 1]['id']) if len(rows) > limit else None
+        }
+
+    stream = stream_despesas(conditions, params, formato)
+    primeiro = await stream.__anext__()
+
+    media_type = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename="despesas_{cnpj}.{formato}"'}
+    return StreamingResponse(prepend(primeiro, stream), media_type=media_type, headers=headers)
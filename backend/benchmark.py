@@ -0,0 +1,165 @@
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from sqlalchemy.engine import make_url
+from generate_dataset import generate
+from setup_database import DB_URL
+
+BENCHMARK_DIR = os.path.join("output", "benchmark")
+BASELINE_FILE = os.getenv("BENCHMARK_BASELINE", "benchmark_baseline.json")
+TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", "0.25"))
+BENCHMARK_DB_URL = os.getenv("BENCHMARK_DB_URL", "")
+SIZES = {"1x": 1, "10x": 10, "100x": 100}
+STAGES = [
+    ("process", "process_data", "main"),
+    ("consolidate", "consolidate_data", "process_consolidation"),
+    ("enrich", "enrich_data", "main"),
+    ("aggregate", "aggregate_data", "main"),
+    ("database", "setup_database", "main"),
+]
+DEFAULT_STAGES = [name for name, _, _ in STAGES if name != "database"]
+
+def measure(module, entrypoint):
+    stage = importlib.import_module(module)
+    inicio = time.perf_counter()
+    getattr(stage, entrypoint)()
+    segundos = time.perf_counter() - inicio
+    pico_processo_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    pico_filhos_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(json.dumps({
+        'segundos': segundos,
+        'pico_mb': pico_processo_mb + pico_filhos_mb,
+        'pico_processo_mb': pico_processo_mb,
+        'pico_filhos_mb': pico_filhos_mb,
+    }))
+
+def same_database(url, other):
+    if not url or not other: return False
+    normalize = lambda u: make_url(u).set(drivername='postgresql', password=None).render_as_string()
+    return normalize(url) == normalize(other)
+
+def check_database_stage():
+    if not BENCHMARK_DB_URL:
+        print("Erro: a etapa database exige BENCHMARK_DB_URL apontando para um banco descartavel")
+        sys.exit(1)
+    if same_database(BENCHMARK_DB_URL, DB_URL):
+        print("Erro: BENCHMARK_DB_URL aponta para o mesmo banco de DB_URL (usado pela API); use um banco descartavel")
+        sys.exit(1)
+
+def run_measured(work_dir, module, entrypoint):
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [backend_dir, os.getenv("PYTHONPATH")])))
+    if module == "setup_database":
+        env['DB_URL'] = BENCHMARK_DB_URL
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", module, entrypoint],
+        cwd=work_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(f"Erro: {module}.{entrypoint} falhou\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+        sys.exit(1)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def seed_cadastre(work_dir, cadop_file):
+    import enrich_data
+    from storage import write_frame
+
+    with open(cadop_file, 'rb') as f:
+        df_cad = enrich_data.normalize_cadastre_columns(enrich_data.parse_cadastre(f.read()))
+    cache_dir = os.path.join(work_dir, enrich_data.CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_frame(df_cad, os.path.join(work_dir, enrich_data.CADASTRE_CACHE), fmt='parquet')
+    with open(os.path.join(work_dir, enrich_data.CADASTRE_META), 'w', encoding='utf-8') as f:
+        json.dump({'url': cadop_file, 'etag': None, 'last_modified': None, 'fetched_at': time.time()}, f)
+
+def prepare(size, scale):
+    work_dir = os.path.join(BENCHMARK_DIR, size)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    cadop_file = os.path.join(work_dir, "output", "cadop_sintetico.csv")
+    linhas = generate(scale, output_dir=os.path.join(work_dir, "output", "raw_data"), cadop_file=cadop_file)
+    seed_cadastre(work_dir, cadop_file)
+    return work_dir, linhas
+
+def run_size(size, stages):
+    work_dir, linhas = prepare(size, SIZES[size])
+    ultima = max(i for i, (name, _, _) in enumerate(STAGES) if name in stages)
+    resultados = {}
+    for name, module, entrypoint in STAGES[:ultima + 1]:
+        print(f"[{size}] {name}...", flush=True)
+        medida = run_measured(work_dir, module, entrypoint)
+        if name not in stages: continue
+        medida['linhas_por_s'] = linhas / medida['segundos'] if medida['segundos'] else float('inf')
+        resultados[f"{size}/{name}"] = medida
+    return resultados
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def find_regressions(resultados, baseline, tolerance=TOLERANCE):
+    regressoes = []
+    for key, medida in resultados.items():
+        base = baseline.get(key)
+        if not base: continue
+        if medida['linhas_por_s'] < base['linhas_por_s'] * (1 - tolerance):
+            regressoes.append(f"{key}: vazao {medida['linhas_por_s']:.0f} linhas/s (baseline {base['linhas_por_s']:.0f})")
+        if medida['pico_mb'] > base['pico_mb'] * (1 + tolerance):
+            regressoes.append(f"{key}: pico de memoria {medida['pico_mb']:.0f} MB (baseline {base['pico_mb']:.0f} MB)")
+    return regressoes
+
+def report(resultados):
+    print(f"\n{'etapa':<22}{'segundos':>10}{'linhas/s':>14}{'pico MB':>10}{'processo':>10}{'filhos':>10}")
+    for key, medida in resultados.items():
+        print(f"{key:<22}{medida['segundos']:>10.2f}{medida['linhas_por_s']:>14.0f}{medida['pico_mb']:>10.0f}"
+              f"{medida['pico_processo_mb']:>10.0f}{medida['pico_filhos_mb']:>10.0f}")
+    print("pico MB = pico do processo da etapa + maior pico entre os processos filhos (PROCESS_WORKERS/CONSOLIDATE_WORKERS)")
+
+def main(sizes, stages, update_baseline=False):
+    if "database" in stages:
+        check_database_stage()
+    resultados = {}
+    for size in sizes:
+        resultados.update(run_size(size, stages))
+    report(resultados)
+
+    baseline = load_baseline()
+    if update_baseline:
+        baseline.update(resultados)
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline atualizada: {BASELINE_FILE}")
+        return
+
+    if not baseline:
+        print(f"\nSem baseline em {BASELINE_FILE}; rode com --update-baseline para grava-la")
+        return
+
+    regressoes = find_regressions(resultados, baseline)
+    if regressoes:
+        print(f"\nRegressoes acima de {TOLERANCE:.0%}:")
+        for regressao in regressoes:
+            print(f"  {regressao}")
+        sys.exit(1)
+    print("\nSem regressoes em relacao a baseline")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1x,10x", help=f"tamanhos separados por virgula ({', '.join(SIZES)})")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"etapas separadas por virgula ({', '.join(name for name, _, _ in STAGES)}); database exige BENCHMARK_DB_URL")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--measure", nargs=2, metavar=("MODULE", "ENTRYPOINT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+    else:
+        main(args.sizes.split(","), set(args.stages.split(",")), args.update_baseline)
@@ -1,42 +1,146 @@
 import os
+import shutil
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from storage import frame_exists, is_frame_file, write_frame, write_frames
+from schema import apply_schema, concat_frames, read_typed
+from manifest import INCREMENTAL, load_manifest, save_manifest
+from metrics import count_dropped, count_rows, instrumented, merge_member, track_member
 
 STAGING_DIR = os.path.join("output", "staging_data")
 OUTPUT_DIR = "output"
 OUTPUT_FILE = os.path.join(STAGING_DIR, "consolidado_despesas.csv")
+PARTITION_DIR = os.path.join(STAGING_DIR, "particoes")
+PARTITIONS = int(os.getenv("CONSOLIDATE_PARTITIONS", "0"))
+WORKERS = int(os.getenv("CONSOLIDATE_WORKERS", "1"))
 
-def process_consolidation():
-    if not os.path.exists(STAGING_DIR): 
-        return
-    
-    all_files = [os.path.join(STAGING_DIR, f) for f in os.listdir(STAGING_DIR) if f.endswith('.csv') and 'consolidado' not in f]
-    
-    if not all_files: 
-        return
-
+def load_frames(files):
     df_list = []
-    for f in all_files:
+    for f in files:
         try:
-            df = pd.read_csv(f, encoding='utf-8')
+            df = read_typed(f)
             df_list.append(df)
         except: continue
 
-    if not df_list: return
+    return concat_frames(df_list)
 
-    full_df = pd.concat(df_list, ignore_index=True)
+def normalize(full_df):
+    linhas = len(full_df)
+    count_rows(entrada=linhas)
     full_df.drop_duplicates(inplace=True)
-    full_df = full_df[full_df['ValorDespesas'] != 0]
+    count_dropped('duplicados', linhas - len(full_df))
 
-    full_df['Trimestre'] = pd.to_datetime(full_df['Trimestre'], errors='coerce').dt.strftime('%Y-%m-%d')
-    full_df['Ano'] = pd.to_datetime(full_df['Trimestre']).dt.year
+    linhas = len(full_df)
+    full_df = full_df[full_df['ValorDespesas'] != 0].copy()
+    count_dropped('valor_zero', linhas - len(full_df))
+
+    datas = pd.to_datetime(full_df['Trimestre'], errors='coerce')
+    full_df['Trimestre'] = datas.dt.strftime('%Y-%m-%d')
+    full_df['Ano'] = datas.dt.year
 
     if 'CNPJ' not in full_df.columns: full_df['CNPJ'] = ''
     if 'RazaoSocial' not in full_df.columns: full_df['RazaoSocial'] = ''
 
     cols = ['RegistroANS', 'CNPJ', 'RazaoSocial', 'Trimestre', 'Ano', 'ValorDespesas', 'Descricao', 'Conta']
+    count_rows(saida=len(full_df))
+    return apply_schema(full_df[cols].copy())
+
+def split_into_partitions(files, partitions):
+    for i, path in enumerate(files):
+        try:
+            df = read_typed(path)
+        except: continue
+
+        keys = pd.util.hash_pandas_object(df[['RegistroANS', 'Trimestre']], index=False)
+        for part, group in df.groupby((keys % partitions).to_numpy()):
+            part_dir = os.path.join(PARTITION_DIR, f"{part:04d}")
+            os.makedirs(part_dir, exist_ok=True)
+            write_frame(group, os.path.join(part_dir, f"{i:05d}.csv"))
+
+def consolidate_partition(part_dir):
+    with track_member(os.path.basename(part_dir)) as registro:
+        files = [os.path.join(part_dir, f) for f in sorted(os.listdir(part_dir)) if is_frame_file(f)]
+        df = load_frames(files)
+        if df is None: return None, [], registro
+
+        df = normalize(df)
+        out_path = write_frame(df, os.path.join(part_dir, "consolidado.csv"))
+    return out_path, list(df['Trimestre'].dropna().unique()), registro
+
+def consolidate_out_of_core(files, partitions=PARTITIONS, workers=WORKERS):
+    shutil.rmtree(PARTITION_DIR, ignore_errors=True)
+    print(f"Particionando {len(files)} arquivo(s) em {partitions} particoes")
+    split_into_partitions(files, partitions)
+    if not os.path.exists(PARTITION_DIR): return None, []
+
+    part_dirs = [os.path.join(PARTITION_DIR, d) for d in sorted(os.listdir(PARTITION_DIR))]
+    if workers > 1 and len(part_dirs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(consolidate_partition, part_dirs))
+    else:
+        results = [consolidate_partition(d) for d in part_dirs]
+
+    for _, _, registro in results:
+        merge_member(registro)
+
+    out_path = write_frames((read_typed(path) for path, _, _ in results if path), OUTPUT_FILE)
+    shutil.rmtree(PARTITION_DIR)
+    return out_path, sorted({trimestre for _, trimestres, _ in results for trimestre in trimestres})
+
+def consolidate_incremental(manifest):
+    new_df = load_frames(manifest['pendentes'])
+    if new_df is None:
+        print("Nenhum trimestre novo para consolidar")
+        return
+
+    new_df = normalize(new_df)
+    alterados = set(new_df['Trimestre'].dropna())
+
+    old_df = read_typed(OUTPUT_FILE)
+    old_df = old_df[~old_df['Trimestre'].isin(alterados)].copy()
+
+    out_path = write_frame(concat_frames([old_df, new_df]), OUTPUT_FILE)
+    print(f"Atualizado: {out_path} ({len(alterados)} trimestre(s))")
+    return alterados
+
+@instrumented("consolidate")
+def process_consolidation(incremental=INCREMENTAL, partitions=PARTITIONS, workers=WORKERS):
+    if not os.path.exists(STAGING_DIR): 
+        return
+
+    if incremental:
+        manifest = load_manifest()
+        if frame_exists(OUTPUT_FILE):
+            alterados = consolidate_incremental(manifest)
+            if alterados is None: return
+            manifest['trimestres_alterados'] = sorted(alterados | set(manifest['trimestres_alterados']))
+            manifest['pendentes'] = []
+            save_manifest(manifest)
+            return
     
-    full_df[cols].to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
-    print(f"Gerado: {OUTPUT_FILE}")
+    all_files = [os.path.join(STAGING_DIR, f) for f in os.listdir(STAGING_DIR) if is_frame_file(f) and 'consolidado' not in f]
+    
+    if not all_files: 
+        return
+
+    if partitions > 0:
+        out_path, trimestres = consolidate_out_of_core(all_files, partitions, workers)
+        if out_path is None: return
+    else:
+        full_df = load_frames(all_files)
+
+        if full_df is None: return
+
+        full_df = normalize(full_df)
+    
+        out_path = write_frame(full_df, OUTPUT_FILE)
+        trimestres = sorted(full_df['Trimestre'].dropna().unique())
+    print(f"Gerado: {out_path}")
+
+    if incremental:
+        manifest['trimestres_alterados'] = trimestres
+        manifest['pendentes'] = []
+        save_manifest(manifest)
 
 if __name__ == "__main__":
-    process_consolidation()
\ No newline at end of file
+    process_consolidation()
@@ -1,56 +1,138 @@
 import os
+import json
+import zipfile
 import requests
 from datetime import datetime
+from email.utils import formatdate
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from metrics import instrumented
 
 BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/demonstracoes_contabeis"
 OUTPUT_DIR = os.path.join("output", "raw_data")
+WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTEMPTS = 12
 
-def download_last_quarters(limit=3):
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        
+def create_session(workers=WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def list_quarters(attempts=MAX_ATTEMPTS):
     current_date = datetime.now()
     year = current_date.year
     month = current_date.month
-    
+
     current_quarter = (month - 1) // 3
     if current_quarter == 0:
         current_quarter = 4
         year -= 1
 
-    downloaded = 0
-    attempts = 0
-    
-    while downloaded < limit and attempts < 12:
-        file_name = f"{current_quarter}T{year}.zip"
-        url = f"{BASE_URL}/{year}/{file_name}"
-        dir_path = os.path.join(OUTPUT_DIR, str(year), f"Q{current_quarter}")
-        local_path = os.path.join(dir_path, file_name)
-        
-        if os.path.exists(local_path):
-            print(f"Arquivo ja existe: {file_name}")
-            downloaded += 1
-        else:
-            print(f"Baixando: {url}")
-            try:
-                response = requests.get(url, stream=True, timeout=60)
-                if response.status_code == 200:
-                    os.makedirs(dir_path, exist_ok=True)
-                    with open(local_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"Sucesso: {local_path}")
-                    downloaded += 1
-                else:
-                    print(f"Nao disponivel: {file_name}")
-            except Exception as e:
-                print(f"Erro ao baixar {url}: {e}")
-
-        attempts += 1
+    quarters = []
+    for _ in range(attempts):
+        quarters.append((year, current_quarter))
         current_quarter -= 1
         if current_quarter == 0:
             current_quarter = 4
             year -= 1
+    return quarters
+
+def read_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return {}
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def write_meta(meta_path, response):
+    meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return meta
+
+def request_headers(local_path, part_path, meta):
+    headers = {}
+    if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+        headers['Range'] = f"bytes={os.path.getsize(part_path)}-"
+        validator = meta.get('etag') or meta.get('last_modified')
+        if validator:
+            headers['If-Range'] = validator
+    elif os.path.exists(local_path) and zipfile.is_zipfile(local_path):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        headers['If-Modified-Since'] = meta.get('last_modified') or formatdate(os.path.getmtime(local_path), usegmt=True)
+    return headers
+
+def download_file(session, url, local_path, timeout=60):
+    part_path = f"{local_path}.part"
+    meta_path = f"{local_path}.meta.json"
+    meta = read_meta(meta_path)
+    headers = request_headers(local_path, part_path, meta)
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return 'inalterado'
+        if response.status_code == 416:
+            os.remove(part_path)
+            return download_file(session, url, local_path, timeout)
+        if response.status_code not in (200, 206):
+            return 'indisponivel'
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        write_meta(meta_path, response)
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+
+    if not zipfile.is_zipfile(part_path):
+        os.remove(part_path)
+        raise ValueError(f"arquivo corrompido: {url}")
+
+    os.replace(part_path, local_path)
+    return 'baixado'
+
+def fetch_quarter(session, year, quarter, base_url=BASE_URL, output_dir=OUTPUT_DIR):
+    file_name = f"{quarter}T{year}.zip"
+    url = f"{base_url}/{year}/{file_name}"
+    local_path = os.path.join(output_dir, str(year), f"Q{quarter}", file_name)
+
+    try:
+        status = download_file(session, url, local_path)
+    except Exception as e:
+        print(f"Erro ao baixar {url}: {e}")
+        return 'erro'
+
+    if status == 'baixado':
+        print(f"Sucesso: {local_path}")
+    elif status == 'inalterado':
+        print(f"Arquivo ja existe e nao mudou: {file_name}")
+    else:
+        print(f"Nao disponivel: {file_name}")
+    return status
+
+@instrumented("download")
+def download_last_quarters(limit=3, workers=WORKERS, base_url=BASE_URL, output_dir=OUTPUT_DIR):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    candidates = list_quarters()
+    downloaded = 0
+
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        while downloaded < limit and candidates:
+            batch = candidates[:limit - downloaded]
+            candidates = candidates[limit - downloaded:]
+            statuses = executor.map(lambda q: fetch_quarter(session, *q, base_url, output_dir), batch)
+            downloaded += sum(1 for status in statuses if status in ('baixado', 'inalterado'))
 
 if __name__ == "__main__":
-    download_last_quarters()
\ No newline at end of file
+    download_last_quarters()
@@ -1,15 +1,26 @@
 import pandas as pd
+import numpy as np
 import requests
 import io
 import os
 import sys
 import re
+import json
+import time
+from storage import frame_exists, frame_path, read_frame, write_frame
+from schema import apply_schema, coalesce, concat_frames, normalize_cnpj, read_typed
+from manifest import INCREMENTAL, load_manifest
+from metrics import count_flagged, count_rows, instrumented
 
 BASE_DIR_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/"
 STAGING_DIR = os.path.join("output", "staging_data")
 OUTPUT_DIR = "output"
 INPUT_FILE = os.path.join(STAGING_DIR, "consolidado_despesas.csv")
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "consolidado_despesas_enriquecido.csv")
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+CADASTRE_CACHE = os.path.join(CACHE_DIR, "cadop.parquet")
+CADASTRE_META = os.path.join(CACHE_DIR, "cadop.meta.json")
+CADASTRE_TTL = int(os.getenv("CADOP_CACHE_TTL", str(24 * 3600)))
 
 def setup_output():
     if not os.path.exists(OUTPUT_DIR):
@@ -24,15 +35,73 @@ def get_csv_url():
     except: pass
     return None
 
-def download_cadastre():
-    url = get_csv_url() or "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
+def parse_cadastre(content):
+    try:
+        content.decode('utf-8')
+        encoding = 'utf-8'
+    except UnicodeDecodeError:
+        encoding = 'iso-8859-1'
+    return pd.read_csv(io.BytesIO(content), sep=';', encoding=encoding, on_bad_lines='skip', dtype=str)
+
+def download_cadastre(url, meta=None):
+    headers = {}
+    if meta and meta.get('url') == url:
+        if meta.get('etag'): headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+
     print(f"Baixando: {url}")
-    r = requests.get(url, timeout=60)
+    r = requests.get(url, headers=headers, timeout=60)
+    if r.status_code == 304:
+        return None, r
     r.raise_for_status()
+    return parse_cadastre(r.content), r
+
+def read_cache_meta():
+    if not os.path.exists(CADASTRE_META) or not os.path.exists(CADASTRE_CACHE):
+        return None
+    try:
+        with open(CADASTRE_META, encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def write_cache_meta(meta):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(CADASTRE_META, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+def load_cadastre(ttl=CADASTRE_TTL):
+    meta = read_cache_meta()
+    if meta and time.time() - meta['fetched_at'] < ttl:
+        print(f"Usando cadastro em cache: {CADASTRE_CACHE}")
+        return read_frame(CADASTRE_CACHE, fmt='parquet')
+
     try:
-        return pd.read_csv(io.BytesIO(r.content), sep=';', encoding='utf-8', on_bad_lines='skip', dtype=str)
-    except:
-        return pd.read_csv(io.BytesIO(r.content), sep=';', encoding='iso-8859-1', on_bad_lines='skip', dtype=str)
+        url = get_csv_url() or (meta or {}).get('url') or "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
+        df_cad, r = download_cadastre(url, meta)
+    except Exception as e:
+        if not meta: raise
+        print(f"Erro ao revalidar cadastro ({e}), usando cache: {CADASTRE_CACHE}")
+        return read_frame(CADASTRE_CACHE, fmt='parquet')
+
+    if df_cad is None:
+        print("Cadastro nao mudou, usando cache")
+        meta['fetched_at'] = time.time()
+        write_cache_meta(meta)
+        return read_frame(CADASTRE_CACHE, fmt='parquet')
+
+    if df_cad.empty: return df_cad
+    df_cad = normalize_cadastre_columns(df_cad)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_frame(df_cad, CADASTRE_CACHE, fmt='parquet')
+    write_cache_meta({
+        'url': url,
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    })
+    return df_cad
 
 def normalize_cadastre_columns(df):
     df.columns = [c.strip().replace('"', '').replace(' ', '_') for c in df.columns]
@@ -42,37 +111,64 @@ def normalize_cadastre_columns(df):
     df.rename(columns=rename, inplace=True)
     return df
 
-def main():
+@instrumented("cadop")
+def fetch_cadastre():
+    setup_output()
+    try: df_cad = load_cadastre()
+    except Exception as e:
+        print(f"Erro download: {e}"); sys.exit(1)
+
+    if df_cad is None or df_cad.empty: sys.exit(1)
+    count_rows(saida=len(df_cad))
+    print(f"Cadastro pronto: {len(df_cad)} operadoras")
+
+@instrumented("enrich")
+def main(incremental=INCREMENTAL):
     setup_output()
-    if not os.path.exists(INPUT_FILE):
-        print(f"Erro: {INPUT_FILE} nao encontrado.")
+    if not frame_exists(INPUT_FILE):
+        print(f"Erro: {frame_path(INPUT_FILE)} nao encontrado.")
         sys.exit(1)
 
-    df_fin = pd.read_csv(INPUT_FILE, dtype={'RegistroANS': str, 'CNPJ': str}, encoding='utf-8')
-    
-    try: df_cad = download_cadastre()
+    df_fin = read_typed(INPUT_FILE)
+
+    alterados = None
+    if incremental and frame_exists(OUTPUT_FILE):
+        alterados = load_manifest()['trimestres_alterados']
+        if not alterados:
+            print("Nenhum trimestre alterado para enriquecer")
+            return
+        df_fin = df_fin[df_fin['Trimestre'].isin(alterados)].copy()
+    count_rows(entrada=len(df_fin))
+
+    try: df_cad = load_cadastre()
     except Exception as e:
         print(f"Erro download: {e}"); sys.exit(1)
 
     if df_cad is None or df_cad.empty: sys.exit(1)
-    df_cad = normalize_cadastre_columns(df_cad)
 
-    df_fin['RegistroANS'] = pd.to_numeric(df_fin['RegistroANS'], errors='coerce')
-    df_cad['RegistroANS'] = pd.to_numeric(df_cad['RegistroANS'], errors='coerce')
+    df_cad = apply_schema(df_cad[['RegistroANS', 'CNPJ_Cadastre', 'RazaoSocial_Cadastre', 'Modalidade', 'UF']].copy())
+    df_cad['CNPJ_Cadastre'] = normalize_cnpj(df_cad['CNPJ_Cadastre'])
 
-    merged = pd.merge(df_fin, df_cad[['RegistroANS', 'CNPJ_Cadastre', 'RazaoSocial_Cadastre', 'Modalidade', 'UF']], on='RegistroANS', how='left')
+    merged = pd.merge(df_fin, df_cad, on='RegistroANS', how='left')
 
-    merged['CNPJ'] = merged['CNPJ_Cadastre'].fillna(merged['CNPJ'])
-    merged['RazaoSocial'] = merged['RazaoSocial_Cadastre'].fillna(merged['RazaoSocial'])
-    merged['StatusCadastro'] = merged['CNPJ_Cadastre'].apply(lambda x: 'ENCONTRADO' if pd.notna(x) else 'NAO_ENCONTRADO')
-    merged['UF'] = merged['UF'].fillna('DESCONHECIDO')
-    merged['Modalidade'] = merged['Modalidade'].fillna('DESCONHECIDO')
+    merged['CNPJ'] = coalesce(merged['CNPJ_Cadastre'], merged['CNPJ'])
+    merged['RazaoSocial'] = coalesce(merged['RazaoSocial_Cadastre'], merged['RazaoSocial'])
+    merged['StatusCadastro'] = np.where(merged['CNPJ_Cadastre'].notna(), 'ENCONTRADO', 'NAO_ENCONTRADO')
+    count_flagged('sem_cadastro', merged['CNPJ_Cadastre'].isna().sum())
+    merged['UF'] = coalesce(merged['UF'], 'DESCONHECIDO')
+    merged['Modalidade'] = coalesce(merged['Modalidade'], 'DESCONHECIDO')
 
 
     cols = ['RegistroANS', 'CNPJ', 'RazaoSocial', 'Modalidade', 'UF', 'Trimestre', 'Ano', 'ValorDespesas', 'Descricao', 'Conta', 'StatusCadastro']
     
-    merged[cols].to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
-    print(f"Sucesso: {OUTPUT_FILE}")
+    result = apply_schema(merged[cols].copy())
+    count_rows(saida=len(result))
+    if alterados is not None:
+        old_df = read_typed(OUTPUT_FILE)
+        result = concat_frames([old_df[~old_df['Trimestre'].isin(alterados)].copy(), result])
+
+    out_path = write_frame(result, OUTPUT_FILE)
+    print(f"Sucesso: {out_path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import io
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+from validate_data import CNPJ_WEIGHTS1, CNPJ_WEIGHTS2
+
+OUTPUT_DIR = os.path.join("output", "raw_data")
+CADOP_FILE = os.path.join("output", "cadop_sintetico.csv")
+OPERATORS_PER_SCALE = 100
+FIRST_REGISTRO = 300000
+MISSING_FROM_CADOP = 0.02
+LEAF_COVERAGE = 0.8
+
+ACCOUNT_TREE = [
+    ("2", "PASSIVO"),
+    ("21", "PASSIVO CIRCULANTE"),
+    ("211", "PROVISÕES TÉCNICAS DE OPERAÇÕES DE ASSISTÊNCIA À SAÚDE"),
+    ("2111", "PROVISÃO DE CONTRAPRESTAÇÃO NÃO GANHA"),
+    ("2112", "PROVISÃO DE EVENTOS A LIQUIDAR"),
+    ("3", "RECEITAS"),
+    ("31", "CONTRAPRESTAÇÕES EFETIVAS DE PLANO DE ASSISTÊNCIA À SAÚDE"),
+    ("311", "RECEITAS COM OPERAÇÕES DE ASSISTÊNCIA À SAÚDE"),
+    ("3111", "CONTRAPRESTAÇÕES LÍQUIDAS"),
+    ("3112", "CONTRAPRESTAÇÕES DE CORRESPONSABILIDADE CEDIDA"),
+    ("4", "DESPESAS"),
+    ("41", "EVENTOS INDENIZÁVEIS LÍQUIDOS / SINISTROS RETIDOS"),
+    ("411", "EVENTOS CONHECIDOS OU AVISADOS"),
+    ("4111", "EVENTOS CONHECIDOS OU AVISADOS DE ASSISTÊNCIA MÉDICO-HOSPITALAR"),
+    ("41111", "COBERTURA ASSISTENCIAL COM PREÇO PRÉ-ESTABELECIDO"),
+    ("411111", "EVENTOS - CONSULTAS MÉDICAS"),
+    ("411112", "EVENTOS - EXAMES"),
+    ("411113", "EVENTOS - TERAPIAS"),
+    ("411114", "EVENTOS - INTERNAÇÕES"),
+    ("41112", "COBERTURA ASSISTENCIAL COM PREÇO PÓS-ESTABELECIDO"),
+    ("411121", "EVENTOS - CONSULTAS MÉDICAS"),
+    ("411122", "EVENTOS - EXAMES"),
+    ("411123", "EVENTOS - INTERNAÇÕES"),
+    ("4112", "EVENTOS CONHECIDOS OU AVISADOS DE ASSISTÊNCIA ODONTOLÓGICA"),
+    ("41121", "SINISTROS - PROCEDIMENTOS ODONTOLÓGICOS"),
+    ("414", "VARIAÇÃO DA PROVISÃO DE EVENTOS OCORRIDOS E NÃO AVISADOS"),
+    ("4141", "PROVISÃO DE EVENTOS OCORRIDOS E NÃO AVISADOS - PEONA"),
+    ("44", "OUTRAS DESPESAS OPERACIONAIS"),
+    ("441", "OUTRAS DESPESAS COM OPERAÇÕES DE PLANOS DE ASSISTÊNCIA À SAÚDE"),
+    ("4411", "DESPESAS COM PROGRAMAS DE PROMOÇÃO DA SAÚDE"),
+    ("4412", "PROVISÃO PARA PERDAS SOBRE CRÉDITOS"),
+    ("46", "DESPESAS ADMINISTRATIVAS"),
+    ("461", "DESPESAS COM PESSOAL PRÓPRIO"),
+    ("462", "DESPESAS COM SERVIÇOS DE TERCEIROS"),
+    ("463", "DESPESAS COM LOCALIZAÇÃO E FUNCIONAMENTO"),
+]
+MODALIDADES = ["Cooperativa Médica", "Medicina de Grupo", "Seguradora Especializada em Saúde",
+               "Autogestão", "Odontologia de Grupo", "Cooperativa Odontológica", "Filantropia"]
+UFS = ["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "PE", "CE", "GO", "DF", "ES", "PA", "AM", "MT", "MS"]
+
+def leaf_accounts():
+    codigos = [codigo for codigo, _ in ACCOUNT_TREE]
+    return [i for i, codigo in enumerate(codigos) if not any(c != codigo and c.startswith(codigo) for c in codigos)]
+
+def incidence_matrix(leaves):
+    codigos = [codigo for codigo, _ in ACCOUNT_TREE]
+    return np.array([[codigos[leaf].startswith(codigo) for codigo in codigos] for leaf in leaves], dtype=float)
+
+def cnpj_digits(rng, n):
+    body = rng.integers(0, 10, size=(n, 12))
+
+    def calculate_digit(weights, digits):
+        rem = digits @ weights % 11
+        return np.where(rem < 2, 0, 11 - rem)
+
+    digit1 = calculate_digit(CNPJ_WEIGHTS1, body)
+    digits = np.column_stack([body, digit1])
+    digits = np.column_stack([digits, calculate_digit(CNPJ_WEIGHTS2, digits)])
+    return [''.join(map(str, row)) for row in digits]
+
+def quarter_list(quarters, first_year):
+    return [(first_year + i // 4, i % 4 + 1) for i in range(quarters)]
+
+def generate_quarter(rng, registros, porte, year, quarter):
+    leaves = leaf_accounts()
+    presentes = rng.random((len(registros), len(leaves))) < LEAF_COVERAGE
+    valores = rng.lognormal(mean=10, sigma=1.5, size=presentes.shape) * porte[:, None] * presentes
+    incidencia = incidence_matrix(leaves)
+    saldos = valores @ incidencia
+    possui = (presentes @ incidencia) > 0
+
+    linhas, colunas = np.nonzero(possui)
+    return pd.DataFrame({
+        'DATA': f"{year}-{3 * quarter - 2:02d}-01",
+        'REG_ANS': registros[linhas],
+        'CD_CONTA_CONTABIL': [ACCOUNT_TREE[c][0] for c in colunas],
+        'DESCRICAO': [ACCOUNT_TREE[c][1] for c in colunas],
+        'VL_SALDO_INICIAL': 0.0,
+        'VL_SALDO_FINAL': np.round(saldos[linhas, colunas], 2),
+    })
+
+def write_quarter_zip(df, year, quarter, output_dir=OUTPUT_DIR):
+    quarter_dir = os.path.join(output_dir, str(year), f"Q{quarter}")
+    os.makedirs(quarter_dir, exist_ok=True)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, sep=';', decimal=',', float_format='%.2f', index=False, quoting=csv.QUOTE_ALL)
+    zip_path = os.path.join(quarter_dir, f"{quarter}T{year}.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f"{quarter}T{year}.csv", buffer.getvalue().encode('latin1'))
+    return zip_path
+
+def write_cadop(rng, registros, cadop_file=CADOP_FILE):
+    no_cadastro = registros[rng.random(len(registros)) >= MISSING_FROM_CADOP]
+    df = pd.DataFrame({
+        'REGISTRO_OPERADORA': no_cadastro,
+        'CNPJ': cnpj_digits(rng, len(no_cadastro)),
+        'Razao_Social': [f"OPERADORA SINTETICA {registro} LTDA" for registro in no_cadastro],
+        'Nome_Fantasia': [f"SINTETICA {registro}" for registro in no_cadastro],
+        'Modalidade': rng.choice(MODALIDADES, size=len(no_cadastro)),
+        'UF': rng.choice(UFS, size=len(no_cadastro)),
+        'Data_Registro_ANS': '2001-01-01',
+    })
+    os.makedirs(os.path.dirname(cadop_file) or '.', exist_ok=True)
+    df.to_csv(cadop_file, sep=';', index=False, quoting=csv.QUOTE_ALL, encoding='utf-8')
+    return len(df)
+
+def generate(scale=1, quarters=4, first_year=2024, output_dir=OUTPUT_DIR, cadop_file=CADOP_FILE, seed=42):
+    rng = np.random.default_rng(seed)
+    registros = np.arange(FIRST_REGISTRO, FIRST_REGISTRO + int(OPERATORS_PER_SCALE * scale))
+    porte = rng.pareto(1.5, size=len(registros)) + 1
+
+    linhas = 0
+    for year, quarter in quarter_list(quarters, first_year):
+        df = generate_quarter(rng, registros, porte, year, quarter)
+        write_quarter_zip(df, year, quarter, output_dir)
+        linhas += len(df)
+
+    operadoras = write_cadop(rng, registros, cadop_file)
+    print(f"Gerado: {linhas} linha(s) em {quarters} trimestre(s), {operadoras} operadora(s) no CADOP")
+    return linhas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1, help=f"multiplicador de {OPERATORS_PER_SCALE} operadoras")
+    parser.add_argument("--quarters", type=int, default=4)
+    parser.add_argument("--first-year", type=int, default=2024)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--cadop", default=CADOP_FILE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.scale, args.quarters, args.first_year, args.output, args.cadop, args.seed)
@@ -0,0 +1,26 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = os.path.join("output", "manifest.json")
+INCREMENTAL = os.getenv("PIPELINE_INCREMENTAL", "0") == "1"
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {'arquivos': {}, 'pendentes': [], 'trimestres_alterados': []}
+    with open(MANIFEST_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import resource
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+METRICS_DIR = os.path.join("output", "metricas")
+REPORT_FILE = os.path.join("output", "relatorio_execucao.json")
+PROMETHEUS_FILE = os.getenv("PIPELINE_PROMETHEUS_FILE", "")
+
+_current = ContextVar("registro_metricas", default=None)
+_ativas = {}
+_ativas_lock = threading.Lock()
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def carry_peak(registro, pico):
+    if registro is None or pico is None: return
+    registro['_pico_aninhado'] = max(registro.get('_pico_aninhado') or 0, pico)
+
+def cpu_seconds():
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.thread_time() + filhos.ru_utime + filhos.ru_stime
+
+def new_record(**campos):
+    return {**campos, 'linhas_entrada': 0, 'linhas_saida': 0, 'descartes': {}, 'contadores': {}}
+
+@contextmanager
+def measured(registro):
+    pai = _current.get()
+    carry_peak(pai, peak_rss_mb())
+    zerado = reset_peak_rss()
+    token = _current.set(registro)
+    inicio, cpu = time.perf_counter(), cpu_seconds()
+    try:
+        yield registro
+    finally:
+        registro['segundos'] = time.perf_counter() - inicio
+        registro['cpu_segundos'] = cpu_seconds() - cpu
+        aninhado = registro.pop('_pico_aninhado', None)
+        pico = peak_rss_mb() if zerado else None
+        registro['pico_rss_mb'] = max(pico, aninhado or 0) if pico is not None else None
+        carry_peak(pai, registro['pico_rss_mb'])
+        _current.reset(token)
+
+def count_rows(entrada=0, saida=0):
+    registro = _current.get()
+    if registro is None: return
+    registro['linhas_entrada'] += int(entrada)
+    registro['linhas_saida'] += int(saida)
+
+def count_dropped(filtro, linhas):
+    registro = _current.get()
+    if registro is None or not linhas: return
+    registro['descartes'][filtro] = registro['descartes'].get(filtro, 0) + int(linhas)
+
+def count_flagged(contador, linhas):
+    registro = _current.get()
+    if registro is None or not linhas: return
+    registro['contadores'][contador] = registro['contadores'].get(contador, 0) + int(linhas)
+
+def track_member(membro):
+    return measured(new_record(membro=membro))
+
+def merge_member(membro_registro):
+    registro = _current.get()
+    if registro is None or membro_registro is None: return
+    registro.setdefault('membros', []).append(membro_registro)
+    count_rows(membro_registro['linhas_entrada'], membro_registro['linhas_saida'])
+    for filtro, linhas in membro_registro['descartes'].items():
+        count_dropped(filtro, linhas)
+    for contador, linhas in membro_registro['contadores'].items():
+        count_flagged(contador, linhas)
+
+def stage_file(stage):
+    return os.path.join(METRICS_DIR, f"{stage}.json")
+
+def write_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+@contextmanager
+def tracked_overlap(registro):
+    with _ativas_lock:
+        simultaneas = set(_ativas)
+        for outras in _ativas.values():
+            outras.add(registro['etapa'])
+        _ativas[registro['etapa']] = simultaneas
+    try:
+        yield
+    finally:
+        with _ativas_lock:
+            _ativas.pop(registro['etapa'], None)
+        registro['etapas_simultaneas'] = sorted(simultaneas)
+        if simultaneas:
+            for medido in [registro] + registro.get('membros', []):
+                medido['pico_rss_mb'] = None
+
+def instrumented(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            registro = new_record(etapa=stage, inicio=datetime.now().isoformat(), sucesso=False)
+            try:
+                with tracked_overlap(registro), measured(registro):
+                    result = func(*args, **kwargs)
+                registro['sucesso'] = True
+                return result
+            finally:
+                write_json(registro, stage_file(stage))
+        return wrapper
+    return decorator
+
+def load_stage(stage):
+    if not os.path.exists(stage_file(stage)):
+        return None
+    with open(stage_file(stage), encoding='utf-8') as f:
+        return json.load(f)
+
+def prometheus_text(etapas):
+    series = {
+        'ans_etl_stage_seconds': ('Tempo de parede da etapa', 'segundos'),
+        'ans_etl_stage_cpu_seconds': ('Tempo de CPU da thread da etapa mais processos filhos encerrados', 'cpu_segundos'),
+        'ans_etl_stage_rows_in': ('Linhas lidas pela etapa', 'linhas_entrada'),
+        'ans_etl_stage_rows_out': ('Linhas gravadas pela etapa', 'linhas_saida'),
+    }
+    linhas = []
+    for nome, (ajuda, campo) in series.items():
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge"]
+        for registro in etapas:
+            linhas.append(f'{nome}{{stage="{registro["etapa"]}"}} {registro[campo]}')
+
+    linhas += ["# HELP ans_etl_stage_peak_rss_bytes Pico de memoria residente durante a etapa",
+               "# TYPE ans_etl_stage_peak_rss_bytes gauge"]
+    for registro in etapas:
+        if registro.get('pico_rss_mb') is None: continue
+        linhas.append(f'ans_etl_stage_peak_rss_bytes{{stage="{registro["etapa"]}"}} {registro["pico_rss_mb"] * 1024 * 1024}')
+
+    linhas += ["# HELP ans_etl_rows_dropped Linhas descartadas por filtro", "# TYPE ans_etl_rows_dropped gauge"]
+    for registro in etapas:
+        for filtro, valor in sorted(registro['descartes'].items()):
+            linhas.append(f'ans_etl_rows_dropped{{stage="{registro["etapa"]}",filter="{filtro}"}} {valor}')
+
+    linhas += ["# HELP ans_etl_rows_flagged Linhas mantidas mas sinalizadas", "# TYPE ans_etl_rows_flagged gauge"]
+    for registro in etapas:
+        for contador, valor in sorted(registro.get('contadores', {}).items()):
+            linhas.append(f'ans_etl_rows_flagged{{stage="{registro["etapa"]}",counter="{contador}"}} {valor}')
+
+    linhas += ["# HELP ans_etl_member_seconds Tempo de parede por arquivo processado", "# TYPE ans_etl_member_seconds gauge"]
+    for registro in etapas:
+        for membro in registro.get('membros', []):
+            nome = membro['membro'].replace('\\', '\\\\').replace('"', '\\"')
+            linhas.append(f'ans_etl_member_seconds{{stage="{registro["etapa"]}",member="{nome}"}} {membro["segundos"]}')
+    return "\n".join(linhas) + "\n"
+
+def write_report(executadas, puladas, inicio, prometheus_file=PROMETHEUS_FILE):
+    etapas = [registro for registro in map(load_stage, executadas) if registro]
+    write_json({
+        'inicio': inicio,
+        'fim': datetime.now().isoformat(),
+        'etapas': etapas,
+        'puladas': sorted(puladas),
+    }, REPORT_FILE)
+    print(f"Relatorio de execucao: {REPORT_FILE}")
+
+    if prometheus_file:
+        tmp_path = f"{prometheus_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(etapas))
+        os.replace(tmp_path, prometheus_file)
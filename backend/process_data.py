@@ -3,14 +3,23 @@ import zipfile
 import pandas as pd
 import shutil
 import io
+import codecs
+from concurrent.futures import ProcessPoolExecutor
+from storage import write_frame, write_frames
+from schema import apply_schema, read_typed
+from manifest import INCREMENTAL, file_hash, load_manifest, save_manifest
+from metrics import count_dropped, count_rows, instrumented, merge_member, track_member
 
 RAW_DIR = os.path.join("output", "raw_data")
 STAGING_DIR = os.path.join("output", "staging_data")
+WORKERS = int(os.getenv("PROCESS_WORKERS", "1"))
+CHUNK_SIZE = int(os.getenv("PROCESS_CHUNKSIZE", "0"))
+SAMPLE_SIZE = 64 * 1024
 
-def setup_directories():
-    if os.path.exists(STAGING_DIR):
+def setup_directories(clean=True):
+    if clean and os.path.exists(STAGING_DIR):
         shutil.rmtree(STAGING_DIR)
-    os.makedirs(STAGING_DIR)
+    os.makedirs(STAGING_DIR, exist_ok=True)
 
 def read_file_content(f):
     content = f.read()
@@ -26,38 +35,60 @@ def parse_csv(text_content):
     
     for sep in [';', ',']:
         try:
-            df = pd.read_csv(io.StringIO(text_content), sep=sep, on_bad_lines='skip')
+            df = pd.read_csv(io.StringIO(text_content), sep=sep, on_bad_lines='skip', dtype={'CD_CONTA_CONTABIL': str}, **number_format(sep))
             if len(df.columns) > 1: return df
         except:
             continue
     return None
 
-def clean_currency(value):
-    try:
-        if isinstance(value, (int, float)): return float(value)
-        val_str = str(value).replace('R$', '').strip()
-        return float(val_str.replace('.', '').replace(',', '.'))
-    except:
-        return 0.0
+def number_format(sep):
+    return {'decimal': ',', 'thousands': '.'} if sep == ';' else {}
+
+def detect_format(sample):
+    for encoding in ['utf-8-sig', 'utf-8']:
+        try:
+            text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        encoding = 'latin1'
+        text = sample.decode(encoding)
+
+    header = text.split('\n', 1)[0]
+    sep = ';' if ';' in header else ','
+    return encoding, sep
+
+def read_csv_chunks(z, member, encoding, sep, chunksize, **kwargs):
+    with z.open(member) as raw, io.TextIOWrapper(raw, encoding=encoding) as f:
+        for chunk in pd.read_csv(f, sep=sep, on_bad_lines='skip', chunksize=chunksize, **number_format(sep), **kwargs):
+            yield chunk
 
-def remove_contas_sinteticas(df):
+def parse_currency(values):
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float), pd.Series(False, index=values.index)
+
+    texto = values.astype(str).str.replace('R$', '', regex=False).str.strip()
+    texto = texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    parsed = pd.to_numeric(texto, errors='coerce')
+    return parsed, parsed.isna() & values.notna()
+
+def contas_sinteticas(codigos):
+    ordenados = sorted(codigos)
+    return frozenset(codigo for codigo, proximo in zip(ordenados, ordenados[1:]) if proximo.startswith(codigo))
+
+def remove_contas_sinteticas(df, pais=None):
     if 'Conta' not in df.columns:
         return df
 
     df['Conta'] = df['Conta'].astype(str).str.strip()
-    
-    codigos = set(df['Conta'].unique())
-    pais = set()
-
-    for codigo in codigos:
-        for outro in codigos:
-            if outro != codigo and outro.startswith(codigo):
-                pais.add(codigo)
-                break
-    
+
+    if pais is None:
+        pais = contas_sinteticas(df['Conta'].unique())
+
     return df[~df['Conta'].isin(pais)].copy()
 
-def transform_dataframe(df, relative_path):
+def transform_dataframe(df, relative_path, pais=None, indice=None):
     df.columns = [c.upper().strip() for c in df.columns]
     col_map = {
         'DATA': 'Trimestre', 'DT_FIM_EXERCICIO': 'Trimestre',
@@ -67,15 +98,29 @@ def transform_dataframe(df, relative_path):
     df.rename(columns=col_map, inplace=True)
 
     required = ['RegistroANS', 'Conta', 'ValorDespesas', 'Descricao']
-    if not all(c in df.columns for c in required): return None
+    count_rows(entrada=len(df))
+    if not all(c in df.columns for c in required):
+        count_dropped('colunas_ausentes', len(df))
+        return None
 
-    df = remove_contas_sinteticas(df)
+    df['Conta'] = df['Conta'].astype(str).str.strip()
+    if indice is not None:
+        indice['contas'].update(df['Conta'].unique())
+
+    linhas = len(df)
+    df = remove_contas_sinteticas(df, pais)
+    count_dropped('contas_sinteticas', linhas - len(df))
 
     mask = df['Descricao'].astype(str).str.contains('EVENTO|SINISTRO|DESPESA|PROVIS', case=False, na=False)
     filtered = df[mask].copy()
+    count_dropped('palavra_chave', len(df) - len(filtered))
     if filtered.empty: return None
 
-    filtered['ValorDespesas'] = filtered['ValorDespesas'].apply(clean_currency)
+    filtered['ValorDespesas'], invalidos = parse_currency(filtered['ValorDespesas'])
+    if invalidos.any():
+        print(f"Aviso: {invalidos.sum()} valor(es) invalido(s) descartado(s) em {relative_path}")
+        count_dropped('valor_invalido', invalidos.sum())
+        filtered = filtered[~invalidos]
     
     if 'Trimestre' not in filtered.columns:
         parts = relative_path.split(os.sep)
@@ -89,45 +134,204 @@ def transform_dataframe(df, relative_path):
                         filtered['Trimestre'] = f"{year}-{q_map.get(quarter, '01-01')}"
                         break
 
-    return filtered[['RegistroANS', 'Conta', 'Descricao', 'ValorDespesas', 'Trimestre']]
+    count_rows(saida=len(filtered))
+    if indice is not None:
+        indice['mantidas'].update(filtered['Conta'].unique())
+    return apply_schema(filtered[['RegistroANS', 'Conta', 'Descricao', 'ValorDespesas', 'Trimestre']].copy())
+
+def staging_path(member):
+    safe_name = member.replace('/', '_').replace('\\', '_').split('.')[0]
+    return os.path.join(STAGING_DIR, f"{safe_name}_processed.csv")
+
+def process_zip_member_stream(z, member, root, chunksize, indice):
+    with z.open(member) as f:
+        sample = f.read(SAMPLE_SIZE)
+    if not sample: return None
+
+    print(f"Processando (streaming): {member}")
+    encoding, sep = detect_format(sample)
+    try:
+        return write_chunks(z, member, root, encoding, sep, chunksize, indice)
+    except UnicodeDecodeError:
+        if encoding == 'latin1': raise
+        return write_chunks(z, member, root, 'latin1', sep, chunksize, indice)
+
+def write_chunks(z, member, root, encoding, sep, chunksize, indice):
+    chunks = read_csv_chunks(z, member, encoding, sep, chunksize, dtype={'CD_CONTA_CONTABIL': str})
+    frames = (transform_dataframe(chunk, root, frozenset(), indice) for chunk in chunks)
+    return write_frames((df for df in frames if df is not None), staging_path(member))
 
-def process_zip_member(z, member, root):
-    if not member.lower().endswith(('.csv', '.txt')): return
+def process_zip_member(z, member, root, chunksize=0, indice=None):
+    if not member.lower().endswith(('.csv', '.txt')): return None
+    if chunksize > 0: return process_zip_member_stream(z, member, root, chunksize, indice)
 
     with z.open(member) as f:
+        print(f"Processando: {member}")
+        text_content = read_file_content(f)
+        df = parse_csv(text_content)
+
+        if df is None: return None
+
+        processed_df = transform_dataframe(df, root, indice=indice)
+
+        if processed_df is None: return None
+
+        return write_frame(processed_df, staging_path(member))
+
+def process_member(zip_path, member, root, chunksize=0):
+    indice = {'contas': set(), 'mantidas': set()}
+    with track_member(member) as registro:
         try:
-            print(f"Processando: {member}")
-            text_content = read_file_content(f)
-            df = parse_csv(text_content)
-            
-            if df is None: return
-
-            processed_df = transform_dataframe(df, root)
-            
-            if processed_df is not None:
-                safe_name = member.replace('/', '_').replace('\\', '_').split('.')[0]
-                out_path = os.path.join(STAGING_DIR, f"{safe_name}_processed.csv")
-                processed_df.to_csv(out_path, index=False, encoding='utf-8')
+            with zipfile.ZipFile(zip_path, 'r') as z:
+                out_path, error = process_zip_member(z, member, root, chunksize, indice), None
         except Exception as e:
-            print(f"Erro em {member}: {e}")
+            out_path, error = None, str(e)
+    return member, out_path, error, registro, indice
 
-def main():
-    setup_directories()
-    
-    if not os.path.exists(RAW_DIR):
-        print(f"Erro: Diretorio {RAW_DIR} nao encontrado.")
-        return
+def run_tasks(tasks, workers, chunksize):
+    if workers > 1 and len(tasks) > 1:
+        print(f"Processando {len(tasks)} arquivos com {workers} processos")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(process_member, *zip(*tasks), [chunksize] * len(tasks)))
+    return [process_member(*task, chunksize) for task in tasks]
+
+def zip_index(tasks, results, indices=None):
+    indices = dict(indices or {})
+    for zip_path in {task[0] for task in tasks}:
+        indices[zip_path] = {'contas': set(), 'mantidas': set(), 'filtradas': set(), 'saidas': []}
+    for (zip_path, _, _), (_, out_path, _, _, indice) in zip(tasks, results):
+        indices[zip_path]['contas'] |= indice['contas']
+        if out_path:
+            indices[zip_path]['mantidas'] |= indice['mantidas']
+            indices[zip_path]['saidas'].append(out_path)
+    return indices
 
-    for root, _, files in os.walk(RAW_DIR):
-        for file in files:
+def filter_synthetic(path, pais):
+    df = read_typed(path)
+    linhas = len(df)
+    df = df[~df['Conta'].isin(pais)]
+    count_dropped('contas_sinteticas', linhas - len(df))
+    count_rows(saida=len(df) - linhas)
+    write_frame(df, path)
+
+def apply_account_index(indices, pais):
+    refiltrados = set()
+    for zip_path, entry in sorted(indices.items()):
+        extras = entry['mantidas'] & pais
+        if not extras: continue
+        for path in entry['saidas']:
+            filter_synthetic(path, pais)
+        entry['mantidas'] -= extras
+        entry['filtradas'] |= extras
+        refiltrados.add(zip_path)
+    return refiltrados
+
+def list_members():
+    tasks = []
+    for root, dirs, files in os.walk(RAW_DIR):
+        dirs.sort()
+        for file in sorted(files):
             if file.endswith('.zip'):
                 zip_path = os.path.join(root, file)
                 try:
                     with zipfile.ZipFile(zip_path, 'r') as z:
-                        for member in z.namelist():
-                            process_zip_member(z, member, root)
+                        tasks.extend((zip_path, member, root) for member in sorted(z.namelist()))
                 except Exception as e:
                     print(f"Erro no ZIP {file}: {e}")
+    return tasks
+
+def select_changed_zips(tasks, manifest):
+    changed = {}
+    for zip_path in sorted({task[0] for task in tasks}):
+        digest = file_hash(zip_path)
+        entry = manifest['arquivos'].get(zip_path)
+        if entry and entry['sha256'] == digest and 'contas' in entry and all(os.path.exists(p) for p in entry['saidas']):
+            continue
+        if entry:
+            remove_outputs(entry['saidas'])
+        changed[zip_path] = digest
+    return changed
+
+def remove_outputs(paths):
+    for path in paths:
+        if os.path.exists(path): os.remove(path)
+
+def stored_indices(manifest, changed):
+    return {
+        zip_path: {
+            'contas': set(entry['contas']), 'mantidas': set(entry['mantidas']),
+            'filtradas': set(entry['filtradas']), 'saidas': list(entry['saidas']),
+        }
+        for zip_path, entry in manifest['arquivos'].items() if zip_path not in changed and 'contas' in entry
+    }
+
+def update_manifest(manifest, changed, tasks, results, indices, refiltrados):
+    failed = {zip_path for (zip_path, _, _), (_, _, error, _, _) in zip(tasks, results) if error}
+
+    pendentes = set(manifest['pendentes'])
+    for zip_path in sorted(set(changed) | refiltrados):
+        entry = indices[zip_path]
+        if zip_path in failed:
+            manifest['arquivos'].pop(zip_path, None)
+        else:
+            manifest['arquivos'][zip_path] = {
+                'sha256': changed.get(zip_path) or manifest['arquivos'][zip_path]['sha256'],
+                'saidas': entry['saidas'],
+                **{campo: sorted(entry[campo]) for campo in ('contas', 'mantidas', 'filtradas')},
+            }
+        pendentes.update(entry['saidas'])
+    manifest['pendentes'] = sorted(pendentes)
+    save_manifest(manifest)
+
+@instrumented("process")
+def main(workers=WORKERS, chunksize=CHUNK_SIZE, incremental=INCREMENTAL):
+    setup_directories(clean=not incremental)
+
+    if not os.path.exists(RAW_DIR):
+        print(f"Erro: Diretorio {RAW_DIR} nao encontrado.")
+        return
+
+    all_tasks = tasks = list_members()
+    indices = {}
+
+    if incremental:
+        manifest = load_manifest()
+        changed = select_changed_zips(all_tasks, manifest)
+        tasks = [task for task in all_tasks if task[0] in changed]
+        indices = stored_indices(manifest, changed)
+        print(f"Modo incremental: {len(changed)} ZIP(s) novos ou alterados")
+
+    results = run_tasks(tasks, workers, chunksize)
+    indices = zip_index(tasks, results, indices)
+    pais = contas_sinteticas(set().union(*(entry['contas'] for entry in indices.values())))
+
+    if incremental:
+        presentes = {task[0] for task in all_tasks}
+        desatualizados = {zip_path for zip_path, entry in indices.items() if entry['filtradas'] - pais and zip_path in presentes}
+        if desatualizados:
+            print(f"Indice de contas mudou: reprocessando {len(desatualizados)} ZIP(s)")
+            for zip_path in sorted(desatualizados):
+                remove_outputs(indices[zip_path]['saidas'])
+                changed[zip_path] = file_hash(zip_path)
+            extra = [task for task in all_tasks if task[0] in desatualizados]
+            extra_results = run_tasks(extra, workers, chunksize)
+            indices = zip_index(extra, extra_results, indices)
+            tasks, results = tasks + extra, results + extra_results
+
+    print(f"Indice de contas: {len(pais)} conta(s) sintetica(s)")
+    refiltrados = apply_account_index(indices, pais)
+
+    for result in results:
+        merge_member(result[3])
+
+    errors = [(member, error) for member, _, error, _, _ in results if error]
+    for member, error in errors:
+        print(f"Erro em {member}: {error}")
+
+    if incremental:
+        update_manifest(manifest, changed, tasks, results, indices, refiltrados)
+
+    return results
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
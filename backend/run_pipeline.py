@@ -1,23 +1,190 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
 import subprocess
 import sys
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from storage import frame_path
+from metrics import write_report
 
-STEPS = [
-    ("Baixando dados financeiros da ANS", "download_ans_financial_data.py"),
-    ("Processando dados brutos", "process_data.py"),
-    ("Consolidando trimestres", "consolidate_data.py"),
-    ("Enriquecendo dados com CADOP", "enrich_data.py"),
-    ("Gerando agregações e respostas", "aggregate_data.py"),
-    ("Configurando banco de dados", "setup_database.py"),
-]
-
-def run():
-    for label, script in STEPS:
-        print(f"\n{label}")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+Stage = namedtuple("Stage", ["label", "script", "entrypoint", "deps", "inputs", "outputs"])
+
+RAW_DIR = os.path.join("output", "raw_data")
+STAGING_DIR = os.path.join("output", "staging_data")
+CONSOLIDATED_FILE = frame_path(os.path.join(STAGING_DIR, "consolidado_despesas.csv"))
+CADASTRE_CACHE = os.path.join("output", "cache", "cadop.parquet")
+ENRICHED_FILE = frame_path(os.path.join("output", "consolidado_despesas_enriquecido.csv"))
+VALIDATED_FILE = frame_path(os.path.join("output", "consolidado_despesas_validado.csv"))
+AGGREGATED_FILE = os.path.join("output", "despesas_agregadas.csv")
+STATE_FILE = os.path.join("output", "pipeline_state.json")
+WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+FINGERPRINT_ENV = ("PIPELINE_FORMAT", "PIPELINE_INCREMENTAL", "CONSOLIDATE_PARTITIONS")
+
+STAGES = {
+    "download": Stage("Baixando dados financeiros da ANS", "download_ans_financial_data.py", "download_last_quarters",
+                      [], [], [RAW_DIR]),
+    "cadop": Stage("Baixando cadastro de operadoras (CADOP)", "enrich_data.py", "fetch_cadastre",
+                   [], [], [CADASTRE_CACHE]),
+    "process": Stage("Processando dados brutos", "process_data.py", "main",
+                     ["download"], [RAW_DIR], [STAGING_DIR]),
+    "consolidate": Stage("Consolidando trimestres", "consolidate_data.py", "process_consolidation",
+                         ["process"], [STAGING_DIR], [CONSOLIDATED_FILE]),
+    "enrich": Stage("Enriquecendo dados com CADOP", "enrich_data.py", "main",
+                    ["consolidate", "cadop"], [CONSOLIDATED_FILE, CADASTRE_CACHE], [ENRICHED_FILE]),
+    "validate": Stage("Validando dados enriquecidos", "validate_data.py", "main",
+                      ["enrich"], [ENRICHED_FILE], [VALIDATED_FILE]),
+    "aggregate": Stage("Gerando agregações e respostas", "aggregate_data.py", "main",
+                       ["enrich"], [ENRICHED_FILE], [AGGREGATED_FILE]),
+    "database": Stage("Configurando banco de dados", "setup_database.py", "main",
+                      ["enrich", "aggregate"], [ENRICHED_FILE, AGGREGATED_FILE], []),
+}
+OPTIONAL_STAGES = {"validate": os.getenv("PIPELINE_VALIDATE", "0") == "1"}
+
+def list_files(path, exclude):
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+    return [f for f in files if f not in exclude]
+
+def fingerprint(stage):
+    digest = hashlib.sha256()
+    for path in [os.path.join(BACKEND_DIR, stage.script)] + stage.inputs:
+        if not os.path.exists(path):
+            return None
+        for f in list_files(path, set(stage.outputs)):
+            info = os.stat(f)
+            digest.update(f"{f}:{info.st_size}:{info.st_mtime_ns}\n".encode())
+    for name in FINGERPRINT_ENV:
+        digest.update(f"{name}={os.getenv(name, '')}\n".encode())
+    return digest.hexdigest()
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_path = f"{STATE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATE_FILE)
+
+def is_up_to_date(stage, state_entry):
+    if not stage.inputs or not state_entry:
+        return False
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    atual = fingerprint(stage)
+    return atual is not None and atual == state_entry.get('fingerprint')
+
+def downstream(names, stages):
+    selected = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for name, stage in stages.items():
+            if name not in selected and selected.intersection(stage.deps):
+                selected.add(name)
+                changed = True
+    return selected
+
+def run_step(script, entrypoint, in_process=False):
+    module = script[:-len(".py")]
+    if in_process:
+        getattr(importlib.import_module(module), entrypoint)()
+    else:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.getenv("PYTHONPATH")])))
         subprocess.run(
-            [sys.executable, script],
-            check=True
+            [sys.executable, "-c", f"import {module}; {module}.{entrypoint}()"],
+            check=True, env=env
         )
+
+def run_stage(name, stage, in_process):
+    print(f"\n[{name}] {stage.label}")
+    run_step(stage.script, stage.entrypoint, in_process)
+    print(f"[{name}] concluido")
+
+def plan(start=None, force=False):
+    stages = {name: stage for name, stage in STAGES.items() if OPTIONAL_STAGES.get(name, True)}
+    if start and start not in stages:
+        raise SystemExit(f"Etapa desconhecida: {start} (opcoes: {', '.join(stages)})")
+
+    forced = set(stages) if force else set()
+    done = set()
+    if start:
+        forced |= downstream([start], stages)
+        done = set(stages) - downstream([start], stages)
+    return stages, forced, done
+
+def run(in_process=False, start=None, force=False, workers=WORKERS):
+    stages, forced, done = plan(start, force)
+    state = load_state()
+    inicio = datetime.now().isoformat()
+    executadas, puladas = [], set(done)
+    pending = [name for name in stages if name not in done]
+    running = {}
+    failure = None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [] if failure else [
+                name for name in pending
+                if all(dep in done or dep not in stages for dep in stages[name].deps)
+            ]
+            skipped = False
+            for name in ready:
+                pending.remove(name)
+                stage = stages[name]
+                if name not in forced and is_up_to_date(stage, state.get(name)):
+                    print(f"\n[{name}] {stage.label}: entradas inalteradas, pulando")
+                    done.add(name)
+                    puladas.add(name)
+                    skipped = True
+                    continue
+                running[executor.submit(run_stage, name, stage, in_process)] = name
+                executadas.append(name)
+
+            if skipped and not running:
+                continue
+            if not running:
+                if pending and not failure:
+                    failure = f"dependencias nao satisfeitas: {', '.join(pending)}"
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except (Exception, SystemExit) as e:
+                    failure = failure or f"etapa '{name}' falhou ({e})"
+                    continue
+                done.add(name)
+                state[name] = {'fingerprint': fingerprint(stages[name]), 'concluido_em': datetime.now().isoformat()}
+                save_state(state)
+
+    write_report(executadas, puladas, inicio)
+    if failure:
+        print(f"\nPipeline interrompido: {failure}")
+        print("Corrija o problema e rode novamente; as etapas ja concluidas serao puladas (ou use --from <etapa>)")
+        sys.exit(1)
     print("\nPipeline finalizado com sucesso")
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--in-process", action="store_true")
+    parser.add_argument("--from", dest="start", help="reexecuta a partir desta etapa (e as que dependem dela)")
+    parser.add_argument("--force", action="store_true", help="ignora as impressoes digitais e executa todas as etapas")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    run(in_process=args.in_process, start=args.start, force=args.force, workers=args.workers)
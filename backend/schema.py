@@ -0,0 +1,64 @@
+import pandas as pd
+from storage import read_frame
+
+CATEGORICAL_COLUMNS = [
+    'CNPJ', 'RazaoSocial', 'Modalidade', 'UF', 'Trimestre',
+    'Conta', 'Descricao', 'StatusCadastro', 'StatusValidacao',
+]
+DTYPES = {
+    'RegistroANS': 'Int32',
+    'Ano': 'Int16',
+    'ValorDespesas': 'float64',
+    **{col: 'category' for col in CATEGORICAL_COLUMNS},
+}
+
+def normalize_cnpj(values):
+    digits = values.astype('string').str.replace(r'\.0$', '', regex=True).str.replace(r'[^0-9]', '', regex=True)
+    digits = digits.mask(digits == '').str.zfill(14)
+    return digits.astype('category')
+
+def apply_schema(df):
+    for col, dtype in DTYPES.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if col == 'CNPJ':
+            df[col] = normalize_cnpj(df[col])
+        elif dtype == 'category':
+            df[col] = df[col].astype('string').str.strip().astype('category')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+
+        if dtype == 'category' and '' in df[col].cat.categories:
+            df[col] = df[col].cat.remove_categories([''])
+    return df
+
+def read_typed(path, fmt=None, trimestres=None):
+    csv_dtypes = {col: 'category' for col in CATEGORICAL_COLUMNS if col != 'CNPJ'}
+    csv_dtypes['CNPJ'] = str
+    filters = [('Trimestre', 'in', list(trimestres))] if trimestres is not None else None
+    return apply_schema(read_frame(path, fmt, filters=filters, dtype=csv_dtypes))
+
+def coalesce(values, fallback):
+    values = values.astype('category')
+    if not isinstance(fallback, pd.Series):
+        if fallback not in values.cat.categories:
+            values = values.cat.add_categories([fallback])
+        return values.fillna(fallback)
+
+    fallback = fallback.astype('category')
+    categories = values.cat.categories.union(fallback.cat.categories)
+    return values.cat.set_categories(categories).fillna(fallback.cat.set_categories(categories))
+
+def concat_frames(frames):
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        return None
+
+    for col in CATEGORICAL_COLUMNS:
+        if all(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames):
+            categories = frames[0][col].cat.categories
+            for df in frames[1:]:
+                categories = categories.union(df[col].cat.categories)
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
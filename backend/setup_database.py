@@ -2,10 +2,37 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 import sys
 import os
+import io
+import re
+from storage import frame_exists, frame_path
+from schema import read_typed
+from manifest import INCREMENTAL, load_manifest, save_manifest
+from metrics import count_dropped, count_rows, instrumented
 
 DB_URL = os.getenv("DB_URL", "postgresql://postgres:ans_password@db:5432/postgres")
 DATA_FILE = os.path.join("output", "consolidado_despesas_enriquecido.csv")
 AGG_FILE = os.path.join("output", "despesas_agregadas.csv")
+SWAP_TABLES = ('operadoras', 'despesas', 'despesas_agregadas')
+SHADOW_SUFFIX = "_novo"
+COPY_CHUNK_ROWS = 100000
+
+ROLLUPS = {
+    'mv_despesas_operadora_trimestre': ("""
+        SELECT registro_ans, trimestre, SUM(valor_despesas) AS total_despesas, COUNT(*) AS qtd_lancamentos
+        FROM {despesas}
+        GROUP BY registro_ans, trimestre
+    """, ('registro_ans', 'trimestre')),
+    'mv_despesas_uf': ("""
+        SELECT o.uf, SUM(d.valor_despesas) AS despesas_totais, COUNT(DISTINCT d.registro_ans) AS qtd_operadoras
+        FROM {despesas} d
+        JOIN {operadoras} o ON d.registro_ans = o.registro_ans
+        GROUP BY o.uf
+    """, ('uf',)),
+    'mv_estatisticas': ("""
+        SELECT 1 AS id, SUM(valor_despesas) AS total_despesas, AVG(valor_despesas) AS media_despesas, COUNT(*) AS qtd_despesas
+        FROM {despesas}
+    """, ('id',)),
+}
 
 def get_engine():
     try:
@@ -14,64 +41,293 @@ def get_engine():
         print(f"Erro ao conectar no banco: {e}")
         sys.exit(1)
 
-def clean_cnpj(value):
-    try:
-        if pd.isna(value) or str(value).strip() == '':
-            return None
-        return str(int(float(value)))
-    except:
-        return None
-
-def import_data(engine):
-    if not os.path.exists(DATA_FILE):
-        print(f"Erro: {DATA_FILE} nao encontrado. O ETL rodou corretamente?")
+def copy_frame(conn, df, table, chunk_rows=COPY_CHUNK_ROWS):
+    cursor = conn.connection.cursor()
+    sql = f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)"
+    for start in range(0, len(df), chunk_rows):
+        buffer = io.StringIO()
+        df.iloc[start:start + chunk_rows].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+def table_constraints(conn, table):
+    return conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = CAST(:table AS regclass) AND contype IN ('p', 'u', 'f')
+        ORDER BY contype = 'f', conname
+    """), {'table': table}).all()
+
+def table_indexes(conn, table):
+    return conn.execute(text("""
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = :table
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass))
+        ORDER BY indexname
+    """), {'table': table}).all()
+
+def shadow(name):
+    return f"{name}{SHADOW_SUFFIX}"
+
+def partition_key(conn, table):
+    return conn.execute(text("SELECT pg_get_partkeydef(CAST(:table AS regclass))"), {'table': table}).scalar()
+
+def table_partitions(conn, table):
+    return conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+        ORDER BY c.relname
+    """), {'table': table}).scalars().all()
+
+def quarter_partitions(table, trimestres):
+    periodos = sorted({pd.Timestamp(t).to_period('Q') for t in trimestres})
+    return [(f"{table}_{periodo.year}_t{periodo.quarter}", periodo) for periodo in periodos]
+
+def partition_bounds(periodo):
+    return periodo.start_time.date(), (periodo + 1).start_time.date()
+
+def create_partitions(conn, table, trimestres):
+    for name, periodo in quarter_partitions(table, trimestres):
+        inicio, fim = partition_bounds(periodo)
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{inicio}') TO ('{fim}')"))
+
+def create_shadow_tables(conn):
+    for table in SWAP_TABLES:
+        conn.execute(text(f"DROP TABLE IF EXISTS {shadow(table)} CASCADE"))
+        key = partition_key(conn, table)
+        partitioning = f" PARTITION BY {key}" if key else ""
+        conn.execute(text(f"CREATE TABLE {shadow(table)} (LIKE {table} INCLUDING DEFAULTS){partitioning}"))
+
+def build_shadow_indexes(conn):
+    for table in SWAP_TABLES:
+        for name, definition in table_constraints(conn, table):
+            for ref in SWAP_TABLES:
+                definition = definition.replace(f"REFERENCES {ref}(", f"REFERENCES {shadow(ref)}(")
+            conn.execute(text(f"ALTER TABLE {shadow(table)} ADD CONSTRAINT {shadow(name)} {definition}"))
+        for name, definition in table_indexes(conn, table):
+            definition = definition.replace(f"INDEX {name} ON", f"INDEX {shadow(name)} ON", 1)
+            definition = re.sub(rf" ON (ONLY )?(\w+\.)?{table} ", rf" ON \g<2>{shadow(table)} ", definition, count=1)
+            conn.execute(text(definition))
+        conn.execute(text(f"ANALYZE {shadow(table)}"))
+
+def swap_tables(conn):
+    constraints = {table: [name for name, _ in table_constraints(conn, table)] for table in SWAP_TABLES}
+    indexes = {table: [name for name, _ in table_indexes(conn, table)] for table in SWAP_TABLES}
+    sequences = conn.execute(text("""
+        SELECT s.relname, t.relname, a.attname
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_class t ON t.oid = d.refobjid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+        WHERE t.relname = ANY(:tables) AND d.deptype = 'a'
+    """), {'tables': list(SWAP_TABLES)}).all()
+
+    conn.execute(text(f"LOCK TABLE {', '.join(SWAP_TABLES)} IN ACCESS EXCLUSIVE MODE"))
+    for name in ROLLUPS:
+        conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {name}"))
+    for sequence, table, column in sequences:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {shadow(table)}.{column}"))
+    conn.execute(text(f"DROP TABLE {', '.join(SWAP_TABLES)}"))
+    for table in SWAP_TABLES:
+        conn.execute(text(f"ALTER TABLE {shadow(table)} RENAME TO {table}"))
+        for name in constraints[table]:
+            conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {shadow(name)} TO {name}"))
+        for name in indexes[table]:
+            conn.execute(text(f"ALTER INDEX {shadow(name)} RENAME TO {name}"))
+        for partition in table_partitions(conn, table):
+            rename_partition(conn, partition, partition.replace(shadow(table), table, 1))
+
+def rename_partition(conn, old_name, new_name):
+    conn.execute(text(f"ALTER TABLE {old_name} RENAME TO {new_name}"))
+    for (index,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"), {'table': new_name}).all():
+        if index.startswith(old_name):
+            conn.execute(text(f"ALTER INDEX {index} RENAME TO {index.replace(old_name, new_name, 1)}"))
+    for (constraint,) in conn.execute(text("""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = CAST(:table AS regclass) AND contype = 'f' AND conname LIKE :pattern
+    """), {'table': new_name, 'pattern': f"%{SHADOW_SUFFIX}"}).all():
+        conn.execute(text(f"ALTER TABLE {new_name} RENAME CONSTRAINT {constraint} TO {constraint[:-len(SHADOW_SUFFIX)]}"))
+
+def replace_partitions(conn, table, df, trimestres):
+    periodos = pd.to_datetime(df['trimestre'].astype(str)).dt.to_period('Q')
+    partitions = quarter_partitions(table, trimestres)
+
+    for name, periodo in partitions:
+        inicio, fim = partition_bounds(periodo)
+        carga = shadow(name)
+        conn.execute(text(f"DROP TABLE IF EXISTS {carga}"))
+        conn.execute(text(f"CREATE TABLE {carga} (LIKE {table} INCLUDING DEFAULTS)"))
+        copy_frame(conn, df[periodos == periodo], carga)
+        conn.execute(text(f"ALTER TABLE {carga} ADD CONSTRAINT {carga}_limite CHECK (trimestre IS NOT NULL AND trimestre >= '{inicio}' AND trimestre < '{fim}')"))
+
+    for name, periodo in partitions:
+        inicio, fim = partition_bounds(periodo)
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {shadow(name)} FOR VALUES FROM ('{inicio}') TO ('{fim}')"))
+        conn.execute(text(f"ALTER TABLE {shadow(name)} DROP CONSTRAINT {shadow(name)}_limite"))
+        rename_partition(conn, shadow(name), name)
+
+def rollup_exists(conn, name):
+    return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar()
+
+def create_rollups(conn, rename=lambda name: name):
+    for name, (query, key) in ROLLUPS.items():
+        conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {rename(name)}"))
+        conn.execute(text(f"CREATE MATERIALIZED VIEW {rename(name)} AS {query.format(despesas=rename('despesas'), operadoras=rename('operadoras'))}"))
+        conn.execute(text(f"CREATE UNIQUE INDEX {rename(name + '_key')} ON {rename(name)} ({', '.join(key)})"))
+
+def refresh_rollups(conn):
+    if not all(rollup_exists(conn, name) for name in ROLLUPS):
+        create_rollups(conn)
+        return
+    for name in ROLLUPS:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+
+def swap_rollups(conn):
+    for name in ROLLUPS:
+        conn.execute(text(f"ALTER MATERIALIZED VIEW {shadow(name)} RENAME TO {name}"))
+        conn.execute(text(f"ALTER INDEX {shadow(name + '_key')} RENAME TO {name}_key"))
+
+def stamp_generation(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS controle_carga (
+            id SMALLINT PRIMARY KEY,
+            geracao BIGINT NOT NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO controle_carga (id, geracao) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET geracao = controle_carga.geracao + 1, atualizado_em = NOW()
+    """))
+
+def bulk_load(engine, df_ops, df_fin, df_agg):
+    with engine.begin() as conn:
+        print("3. Criando tabelas de carga...")
+        create_shadow_tables(conn)
+
+        print("4. Copiando Operadoras (COPY)...")
+        copy_frame(conn, df_ops, shadow('operadoras'))
+
+        print("5. Copiando Despesas (COPY)...")
+        if partition_key(conn, 'despesas'):
+            create_partitions(conn, shadow('despesas'), df_fin['trimestre'].unique())
+        copy_frame(conn, df_fin, shadow('despesas'))
+
+        if not df_agg.empty:
+            print("6. Copiando Agregados (COPY)...")
+            copy_frame(conn, df_agg, shadow('despesas_agregadas'))
+
+        print("7. Criando chaves e indices...")
+        build_shadow_indexes(conn)
+
+        print("8. Calculando visoes materializadas...")
+        create_rollups(conn, shadow)
+
+        print("9. Trocando tabelas...")
+        swap_tables(conn)
+        swap_rollups(conn)
+        stamp_generation(conn)
+
+def upsert_operadoras(df_ops, conn):
+    conn.execute(text("CREATE TEMP TABLE operadoras_stage (LIKE operadoras) ON COMMIT DROP"))
+    copy_frame(conn, df_ops, 'operadoras_stage')
+    conn.execute(text("""
+        INSERT INTO operadoras (registro_ans, cnpj, razao_social, modalidade, uf)
+        SELECT registro_ans, cnpj, razao_social, modalidade, uf FROM operadoras_stage
+        ON CONFLICT (registro_ans) DO UPDATE SET
+            cnpj = EXCLUDED.cnpj,
+            razao_social = EXCLUDED.razao_social,
+            modalidade = EXCLUDED.modalidade,
+            uf = EXCLUDED.uf
+    """))
+    conn.execute(text("UPDATE operadoras SET cnpj = LPAD(cnpj, 14, '0') WHERE cnpj ~ '^[0-9]{1,13}$'"))
+
+def incremental_load(engine, df_ops, df_fin, df_agg, alterados):
+    with engine.begin() as conn:
+        print("3. Atualizando Operadoras...")
+        upsert_operadoras(df_ops, conn)
+
+        print("4. Substituindo Despesas dos trimestres alterados...")
+        if partition_key(conn, 'despesas'):
+            replace_partitions(conn, 'despesas', df_fin, alterados)
+        else:
+            conn.execute(text("DELETE FROM despesas WHERE trimestre = ANY(CAST(:trimestres AS date[]))"), {'trimestres': alterados})
+            copy_frame(conn, df_fin[df_fin['trimestre'].isin(alterados)], 'despesas')
+
+        if not df_agg.empty:
+            print("5. Recarregando Agregados...")
+            conn.execute(text("TRUNCATE TABLE despesas_agregadas"))
+            copy_frame(conn, df_agg, 'despesas_agregadas')
+
+        print("6. Atualizando visoes materializadas...")
+        refresh_rollups(conn)
+        stamp_generation(conn)
+
+def import_data(engine, incremental=INCREMENTAL):
+    if not frame_exists(DATA_FILE):
+        print(f"Erro: {frame_path(DATA_FILE)} nao encontrado. O ETL rodou corretamente?")
         sys.exit(1)
 
-    print("1. Limpando tabelas (TRUNCATE)...")
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE TABLE despesas, operadoras, despesas_agregadas CASCADE;"))
-        conn.commit()
+    alterados = None
+    if incremental:
+        manifest = load_manifest()
+        alterados = manifest['trimestres_alterados']
+        if not alterados:
+            print("Nenhum trimestre alterado, banco ja atualizado.")
+            return
 
     try:
-        print("2. Lendo arquivos CSV...")
-        df_full = pd.read_csv(DATA_FILE, encoding='utf-8')
+        print("1. Lendo arquivos intermediarios...")
+        df_full = read_typed(DATA_FILE)
+        count_rows(entrada=len(df_full))
         
-        if os.path.exists(AGG_FILE):
-            df_agg = pd.read_csv(AGG_FILE, encoding='utf-8')
+        if frame_exists(AGG_FILE):
+            df_agg = read_typed(AGG_FILE)
         else:
             df_agg = pd.DataFrame()
             
     except Exception as e:
-        print(f"Erro leitura CSV: {e}")
+        print(f"Erro leitura dos dados: {e}")
         sys.exit(1)
 
-    print("3. Inserindo Operadoras...")
+    print("2. Preparando Operadoras e Despesas...")
     df_ops = df_full[['RegistroANS', 'CNPJ', 'RazaoSocial', 'Modalidade', 'UF']].drop_duplicates('RegistroANS').copy()
     df_ops.columns = ['registro_ans', 'cnpj', 'razao_social', 'modalidade', 'uf']
     
-    df_ops['registro_ans'] = pd.to_numeric(df_ops['registro_ans'], errors='coerce').fillna(0).astype(int)
-    df_ops['cnpj'] = df_ops['cnpj'].apply(clean_cnpj)
-    
-    df_ops = df_ops[df_ops['registro_ans'] > 0]
+    df_ops = df_ops[df_ops['registro_ans'].gt(0).fillna(False)]
     df_ops = df_ops.dropna(subset=['cnpj'])
-    
-    df_ops.to_sql('operadoras', engine, if_exists='append', index=False)
 
-    print("4. Inserindo Despesas...")
     df_fin = df_full[['RegistroANS', 'Trimestre', 'Ano', 'Conta', 'Descricao', 'ValorDespesas']].copy()
     df_fin.columns = ['registro_ans', 'trimestre', 'ano', 'conta', 'descricao', 'valor_despesas']
     
-    df_fin['registro_ans'] = pd.to_numeric(df_fin['registro_ans'], errors='coerce').fillna(0).astype(int)
-    df_fin = df_fin[df_fin['registro_ans'].isin(df_ops['registro_ans'])] 
-    
-    df_fin.to_sql('despesas', engine, if_exists='append', index=False)
+    com_operadora = df_fin['registro_ans'].isin(df_ops['registro_ans'])
+    count_dropped('operadora_invalida', (~com_operadora).sum())
+    count_dropped('trimestre_nulo', (com_operadora & df_fin['trimestre'].isna()).sum())
+    df_fin = df_fin[com_operadora & df_fin['trimestre'].notna()]
+    count_rows(saida=len(df_fin))
 
     if not df_agg.empty:
-        print("5. Inserindo Agregados...")
         df_agg.columns = ['razao_social', 'uf', 'total_despesas', 'media_trimestral', 'desvio_padrao']
-        df_agg.to_sql('despesas_agregadas', engine, if_exists='append', index=False)
 
-if __name__ == "__main__":
+    if alterados is None:
+        bulk_load(engine, df_ops, df_fin, df_agg)
+        return
+
+    print(f"Modo incremental: substituindo {len(alterados)} trimestre(s)")
+    incremental_load(engine, df_ops, df_fin, df_agg, alterados)
+
+    manifest['trimestres_alterados'] = []
+    save_manifest(manifest)
+
+@instrumented("database")
+def main():
     engine = get_engine()
     import_data(engine)
-    print(">>> Sucesso! Importação concluída.")
\ No newline at end of file
+    print(">>> Sucesso! Importação concluída.")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FORMAT = os.getenv("PIPELINE_FORMAT", "csv")
+
+def frame_path(path, fmt=None):
+    base, _ = os.path.splitext(path)
+    return f"{base}.{fmt or FORMAT}"
+
+def frame_exists(path, fmt=None):
+    return os.path.exists(frame_path(path, fmt))
+
+def is_frame_file(name, fmt=None):
+    return name.endswith(f".{fmt or FORMAT}")
+
+FILTER_CHUNK_ROWS = 500000
+
+def read_frame(path, fmt=None, filters=None, **csv_kwargs):
+    fmt = fmt or FORMAT
+    if fmt == 'parquet':
+        return pd.read_parquet(frame_path(path, fmt), filters=filters)
+    if not filters:
+        return pd.read_csv(frame_path(path, fmt), encoding='utf-8', **csv_kwargs)
+
+    chunks = pd.read_csv(frame_path(path, fmt), encoding='utf-8', chunksize=FILTER_CHUNK_ROWS, **csv_kwargs)
+    return pd.concat([apply_filters(chunk, filters) for chunk in chunks], ignore_index=True)
+
+def apply_filters(df, filters):
+    for col, op, values in filters:
+        if op != 'in':
+            raise ValueError(f"Filtro nao suportado: {op}")
+        df = df[df[col].isin(values)]
+    return df
+
+def widen_dictionaries(schema):
+    fields = [
+        field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ]
+    return pa.schema(fields, metadata=schema.metadata)
+
+def write_frame(df, path, fmt=None):
+    return write_frames([df], path, fmt)
+
+def write_frames(frames, path, fmt=None):
+    fmt = fmt or FORMAT
+    out_path = frame_path(path, fmt)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+
+    writer = None
+    written = False
+    try:
+        for df in frames:
+            if fmt == 'parquet':
+                if writer is None:
+                    schema = widen_dictionaries(pa.Schema.from_pandas(df, preserve_index=False))
+                    writer = pq.ParquetWriter(out_path, schema)
+                table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+            else:
+                df.to_csv(out_path, mode='a', header=not written, index=False, encoding='utf-8')
+            written = True
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return out_path if written else None
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import aggregate_data
+import storage
+from storage import write_frame
+
+def enriched(trimestres, valor):
+    linhas = [(razao, uf, 'Medicina de Grupo', trimestre, valor * (i + 1))
+              for trimestre in trimestres
+              for i, (razao, uf) in enumerate([('OPERADORA A', 'SP'), ('OPERADORA A', 'SP'), ('OPERADORA B', 'RJ')])]
+    return pd.DataFrame(linhas, columns=['RazaoSocial', 'UF', 'Modalidade', 'Trimestre', 'ValorDespesas'])
+
+@pytest.fixture(params=['csv', 'parquet'])
+def fmt(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, 'FORMAT', request.param)
+    monkeypatch.setattr(storage, 'FILTER_CHUNK_ROWS', 2)
+    (tmp_path / 'output').mkdir()
+    return request.param
+
+def sorted_state(estado):
+    return estado.astype({col: str for col in aggregate_data.STATE_KEYS}).sort_values(aggregate_data.STATE_KEYS).reset_index(drop=True)
+
+def test_incremental_state_reads_only_changed_quarters(fmt, monkeypatch):
+    antigos = ['2024-03-31', '2024-06-30']
+    write_frame(enriched(antigos, 10.0), aggregate_data.INPUT_FILE)
+    aggregate_data.update_state(incremental=False)
+
+    atualizado = pd.concat([enriched(antigos[:1], 10.0), enriched(antigos[1:], 30.0), enriched(['2024-09-30'], 5.0)])
+    write_frame(atualizado, aggregate_data.INPUT_FILE)
+    monkeypatch.setattr(aggregate_data, 'load_manifest', lambda: {'trimestres_alterados': ['2024-06-30', '2024-09-30']})
+    lidas = []
+    read_typed = aggregate_data.read_typed
+
+    def spy(*args, **kwargs):
+        df = read_typed(*args, **kwargs)
+        lidas.append(len(df))
+        return df
+    monkeypatch.setattr(aggregate_data, 'read_typed', spy)
+
+    incremental = aggregate_data.update_state(incremental=True)
+
+    assert lidas[0] == 6
+    completo = aggregate_data.partial_state(atualizado)
+    pd.testing.assert_frame_equal(sorted_state(incremental), sorted_state(completo), check_dtype=False, check_categorical=False)
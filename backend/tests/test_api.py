@@ -0,0 +1,135 @@
+import os
+from datetime import date
+
+import pytest
+
+@pytest.fixture(scope="module")
+def client():
+    if not os.getenv("DB_URL"):
+        pytest.skip("DB_URL nao definido")
+    from fastapi.testclient import TestClient
+    import api
+
+    with TestClient(api.app) as c:
+        yield c
+
+@pytest.fixture(scope="module")
+def cnpj(client):
+    operadoras = client.get("/api/operadoras", params={'limit': 1}).json()['data']
+    if not operadoras:
+        pytest.skip("banco sem operadoras carregadas")
+    return operadoras[0]['cnpj']
+
+def test_quarter_range_is_half_open():
+    import api
+
+    assert api.quarter_range(2024, 1) == (date(2024, 1, 1), date(2024, 4, 1))
+    assert api.quarter_range(2024, 4) == (date(2024, 10, 1), date(2025, 1, 1))
+    assert api.quarter_range(2024) == (date(2024, 1, 1), date(2025, 1, 1))
+
+def test_export_rejects_before_cursor(client, cnpj):
+    import api
+
+    response = client.get(f"/api/operadoras/{cnpj}/despesas/export",
+                          params={'formato': 'json', 'cursor': api.encode_cursor('before', 10)})
+
+    assert response.status_code == 400
+
+def test_export_pages_follow_after_cursor(client, cnpj):
+    url = f"/api/operadoras/{cnpj}/despesas/export"
+    primeira = client.get(url, params={'formato': 'json', 'limit': 2}).json()
+    if not primeira['next_cursor']:
+        pytest.skip("operadora com poucas despesas")
+
+    segunda = client.get(url, params={'formato': 'json', 'limit': 2, 'cursor': primeira['next_cursor']}).json()
+
+    assert segunda['data'][0]['id'] > primeira['data'][-1]['id']
+
+def test_export_quarter_filter_matches_quarter(client, cnpj):
+    url = f"/api/operadoras/{cnpj}/despesas/export"
+    todas = client.get(url, params={'formato': 'json', 'limit': 1000}).json()['data']
+    if not todas:
+        pytest.skip("operadora sem despesas")
+    ano, mes = map(int, todas[0]['trimestre'][:7].split('-'))
+    trimestre = (mes - 1) // 3 + 1
+
+    filtradas = client.get(url, params={'formato': 'json', 'limit': 1000, 'ano': ano, 'trimestre': trimestre}).json()['data']
+
+    esperadas = [row['id'] for row in todas
+                 if int(row['trimestre'][:4]) == ano and (int(row['trimestre'][5:7]) - 1) // 3 + 1 == trimestre]
+    assert [row['id'] for row in filtradas] == esperadas
+
+@pytest.mark.parametrize("formato", ['json', 'ndjson', 'csv'])
+def test_export_unknown_operadora_is_404(client, formato):
+    response = client.get("/api/operadoras/00000000000000/despesas/export", params={'formato': formato})
+
+    assert response.status_code == 404
+
+def test_export_stream_matches_pages(client, cnpj):
+    url = f"/api/operadoras/{cnpj}/despesas/export"
+    pagina = client.get(url, params={'formato': 'json', 'limit': 1000}).json()['data']
+
+    linhas = client.get(url, params={'formato': 'csv'}).text.splitlines()
+
+    assert linhas[0] == 'id,ano,trimestre,conta,descricao,valor_despesas'
+    assert [int(linha.split(',')[0]) for linha in linhas[1:]] == [row['id'] for row in pagina]
+
+def test_cursor_pages_omit_page(client):
+    primeira = client.get("/api/operadoras", params={'limit': 2}).json()
+    if not primeira['next_cursor']:
+        pytest.skip("banco com poucas operadoras")
+
+    segunda = client.get("/api/operadoras", params={'limit': 2, 'cursor': primeira['next_cursor']}).json()
+
+    assert primeira['page'] == 1
+    assert 'page' not in segunda
+    assert segunda['data'][0]['registro_ans'] > primeira['data'][-1]['registro_ans']
+
+def test_page_and_cursor_together_are_rejected(client):
+    import api
+
+    response = client.get("/api/operadoras", params={'page': 2, 'cursor': api.encode_cursor('after', 1)})
+
+    assert response.status_code == 400
+
+def test_response_cache_is_bounded_by_bytes(monkeypatch):
+    import api
+
+    monkeypatch.setattr(api, '_response_cache', api.OrderedDict())
+    monkeypatch.setattr(api, '_response_cache_bytes', {'total': 0})
+    monkeypatch.setattr(api, 'RESPONSE_CACHE_MAX_BYTES', 250)
+    monkeypatch.setattr(api, 'RESPONSE_CACHE_MAX_ENTRY_BYTES', 120)
+
+    for i in range(4):
+        api.cache_body((f"/a/{i}", 1), b"x" * 100)
+    api.cache_body(("/grande", 1), b"x" * 121)
+
+    assert list(api._response_cache) == [("/a/2", 1), ("/a/3", 1)]
+    assert api._response_cache_bytes['total'] == 200
+
+def test_normalize_cnpj_pads_like_the_loader():
+    import api
+
+    assert api.normalize_cnpj('1.222.333/0001-28') == '01222333000128'
+    assert api.normalize_cnpj('01222333000128') == '01222333000128'
+    assert api.normalize_cnpj('abc') == ''
+
+@pytest.fixture
+def operadora_zero_esquerda(client):
+    from sqlalchemy import text
+    import setup_database
+
+    engine = setup_database.get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO operadoras (registro_ans, cnpj, razao_social) VALUES (999997, '01222333000128', 'ZERO A ESQUERDA')"))
+    yield 999997
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM operadoras WHERE registro_ans = 999997"))
+    engine.dispose()
+
+def test_batch_matches_unpadded_cnpj(client, operadora_zero_esquerda):
+    resposta = client.post("/api/operadoras/batch", json={'cnpjs': ['1222333000128', '1.222.333/0001-28', '99999999999999']}).json()
+
+    assert [operadora['registro_ans'] for operadora in resposta['data']] == [operadora_zero_esquerda]
+    assert resposta['cnpjs'] == {'1222333000128': operadora_zero_esquerda, '1.222.333/0001-28': operadora_zero_esquerda}
+    assert resposta['nao_encontrados']['cnpjs'] == ['99999999999999']
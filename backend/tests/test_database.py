@@ -0,0 +1,132 @@
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import setup_database
+
+@pytest.fixture
+def conn():
+    if not os.getenv("DB_URL"):
+        pytest.skip("DB_URL nao definido")
+    engine = setup_database.get_engine()
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            yield connection
+        finally:
+            transaction.rollback()
+    engine.dispose()
+
+def test_upsert_pads_existing_cnpjs(conn):
+    conn.execute(text("INSERT INTO operadoras (registro_ans, cnpj, razao_social) VALUES (999998, '1222333000128', 'ANTIGA')"))
+    df_ops = pd.DataFrame({'registro_ans': [999999], 'cnpj': ['01222333000209'], 'razao_social': ['NOVA'],
+                           'modalidade': [None], 'uf': ['SP']})
+
+    setup_database.upsert_operadoras(df_ops, conn)
+
+    cnpjs = dict(conn.execute(text("SELECT registro_ans, cnpj FROM operadoras WHERE registro_ans >= 999998")).all())
+    assert cnpjs == {999998: '01222333000128', 999999: '01222333000209'}
+
+TABELA = 'despesas_teste_particoes'
+
+def despesas(trimestre, valores):
+    return pd.DataFrame({
+        'registro_ans': [300001] * len(valores), 'trimestre': [trimestre] * len(valores), 'ano': [int(trimestre[:4])] * len(valores),
+        'conta': ['411111'] * len(valores), 'descricao': ['EVENTOS'] * len(valores), 'valor_despesas': valores,
+    })
+
+@pytest.fixture
+def particionada(conn):
+    conn.execute(text(f"""
+        CREATE TABLE {TABELA} (
+            id SERIAL, registro_ans INT, trimestre DATE NOT NULL, ano INT, conta VARCHAR(50),
+            descricao VARCHAR(255), valor_despesas DECIMAL(15,2), PRIMARY KEY (id, trimestre)
+        ) PARTITION BY RANGE (trimestre)
+    """))
+    conn.execute(text(f"CREATE INDEX {TABELA}_registro_trimestre ON {TABELA} (registro_ans, trimestre)"))
+    setup_database.create_partitions(conn, TABELA, ['2024-03-01', '2024-06-01'])
+    setup_database.copy_frame(conn, pd.concat([despesas('2024-03-01', [1.0, 2.0]), despesas('2024-06-01', [3.0])]), TABELA)
+    return conn
+
+def valores(conn):
+    return conn.execute(text(f"SELECT tableoid::regclass::text, valor_despesas FROM {TABELA} ORDER BY 1, 2")).all()
+
+def test_replace_partitions_swaps_only_changed_quarter(particionada):
+    setup_database.replace_partitions(particionada, TABELA, despesas('2024-06-01', [7.0, 8.0]), ['2024-06-01'])
+
+    assert setup_database.table_partitions(particionada, TABELA) == [f"{TABELA}_2024_t1", f"{TABELA}_2024_t2"]
+    assert [(p, float(v)) for p, v in valores(particionada)] == [
+        (f"{TABELA}_2024_t1", 1.0), (f"{TABELA}_2024_t1", 2.0), (f"{TABELA}_2024_t2", 7.0), (f"{TABELA}_2024_t2", 8.0),
+    ]
+    restos = particionada.execute(text("""
+        SELECT relname FROM pg_class WHERE relname LIKE :padrao
+        UNION ALL SELECT conname FROM pg_constraint WHERE conname LIKE :padrao
+    """), {'padrao': f"{TABELA}%{setup_database.SHADOW_SUFFIX}%"}).scalars().all()
+    assert restos == []
+    assert particionada.execute(text(f"SELECT COUNT(*) FROM pg_constraint WHERE conname LIKE '{TABELA}%_limite'")).scalar() == 0
+
+def test_failed_swap_keeps_previous_quarter(particionada, monkeypatch):
+    def falha(conn, old_name, new_name):
+        raise RuntimeError("falha depois do ATTACH")
+    monkeypatch.setattr(setup_database, 'rename_partition', falha)
+    antes = valores(particionada)
+
+    savepoint = particionada.begin_nested()
+    with pytest.raises(RuntimeError):
+        setup_database.replace_partitions(particionada, TABELA, despesas('2024-06-01', [9.0]), ['2024-06-01'])
+    savepoint.rollback()
+
+    assert setup_database.table_partitions(particionada, TABELA) == [f"{TABELA}_2024_t1", f"{TABELA}_2024_t2"]
+    assert valores(particionada) == antes
+
+INIT_SQL = os.path.join(os.path.dirname(__file__), '..', '..', 'db', 'init.sql')
+
+def test_fresh_database_has_empty_rollups(conn):
+    disponiveis = conn.execute(text("SELECT COUNT(*) FROM pg_available_extensions WHERE name IN ('pg_trgm', 'unaccent')")).scalar()
+    if disponiveis < 2:
+        pytest.skip("pg_trgm/unaccent indisponiveis neste servidor")
+    with open(INIT_SQL, encoding='utf-8') as f:
+        conn.exec_driver_sql(f.read())
+
+    assert conn.execute(text("SELECT total_despesas, media_despesas FROM mv_estatisticas")).one() == (None, None)
+    assert conn.execute(text("SELECT COUNT(*) FROM mv_despesas_operadora_trimestre")).scalar() == 0
+    setup_database.refresh_rollups(conn)
+    assert all(setup_database.rollup_exists(conn, name) for name in setup_database.ROLLUPS)
+
+class CargaNaTransacao:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def begin(self):
+        with self.conn.begin_nested():
+            yield self.conn
+
+def test_bulk_load_twice_keeps_schema(conn):
+    df_ops = pd.DataFrame({'registro_ans': [300001, 300002], 'cnpj': ['01222333000128', '11222333000181'],
+                           'razao_social': ['OPERADORA A', 'OPERADORA B'], 'modalidade': [None, None], 'uf': ['SP', 'RJ']})
+    df_fin = pd.concat([despesas('2024-03-01', [1.0, 2.0]), despesas('2024-06-01', [3.0])])
+    df_agg = pd.DataFrame({'razao_social': ['OPERADORA A'], 'uf': ['SP'], 'total_despesas': [6.0],
+                           'media_trimestral': [3.0], 'desvio_padrao': [0.0]})
+    esquema = {table: (setup_database.table_constraints(conn, table), setup_database.table_indexes(conn, table))
+               for table in setup_database.SWAP_TABLES}
+
+    for _ in range(2):
+        setup_database.bulk_load(CargaNaTransacao(conn), df_ops, df_fin, df_agg)
+
+    contagens = {table: conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() for table in setup_database.SWAP_TABLES}
+    assert contagens == {'operadoras': 2, 'despesas': 3, 'despesas_agregadas': 1}
+    assert {table: (setup_database.table_constraints(conn, table), setup_database.table_indexes(conn, table))
+            for table in setup_database.SWAP_TABLES} == esquema
+    assert conn.execute(text("SELECT pg_get_serial_sequence('despesas', 'id')")).scalar() is not None
+    if setup_database.partition_key(conn, 'despesas'):
+        assert setup_database.table_partitions(conn, 'despesas') == ['despesas_2024_t1', 'despesas_2024_t2']
+    assert conn.execute(text("SELECT qtd_despesas FROM mv_estatisticas")).scalar() == 3
+    restos = conn.execute(text("""
+        SELECT relname FROM pg_class WHERE relname LIKE '%\\_novo%' OR relname LIKE '%\\_antigo%'
+        UNION ALL SELECT conname FROM pg_constraint WHERE conname LIKE '%\\_novo%' OR conname LIKE '%\\_antigo%'
+    """)).scalars().all()
+    assert restos == []
@@ -0,0 +1,201 @@
+import io
+import json
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import download_ans_financial_data as downloader
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+def make_zip(content):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr("1T2025.csv", content)
+    return buffer.getvalue()
+
+class StandIn(BaseHTTPRequestHandler):
+    files = {}
+    requests_seen = []
+    truncate_after = None
+    force_416 = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests_seen.append(dict(self.headers))
+        entry = self.files.get(self.path)
+        if entry is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body, etag = entry
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        byte_range = self.headers.get('Range')
+        if byte_range and self.force_416:
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        if byte_range and self.headers.get('If-Range') in (etag, LAST_MODIFIED):
+            start = int(byte_range.split('=')[1].rstrip('-'))
+
+        payload = body[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(payload)))
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+
+        if self.truncate_after is not None:
+            self.wfile.write(payload[:self.truncate_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(payload)
+
+@pytest.fixture
+def server():
+    StandIn.files = {}
+    StandIn.requests_seen = []
+    StandIn.truncate_after = None
+    StandIn.force_416 = False
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def session():
+    with requests.Session() as s:
+        yield s
+
+def test_full_download_promotes_part_file(server, session, tmp_path):
+    body = make_zip(b"a" * 5000)
+    StandIn.files['/2025/1T2025.zip'] = (body, '"v1"')
+    local_path = str(tmp_path / "2025" / "Q1" / "1T2025.zip")
+
+    assert downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path) == 'baixado'
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == body
+    assert not os.path.exists(f"{local_path}.part")
+    with open(f"{local_path}.meta.json", encoding='utf-8') as f:
+        assert json.load(f) == {'etag': '"v1"', 'last_modified': LAST_MODIFIED}
+
+def test_resumes_from_existing_part(server, session, tmp_path):
+    body = make_zip(os.urandom(20000))
+    StandIn.files['/2025/1T2025.zip'] = (body, '"v1"')
+    local_path = str(tmp_path / "1T2025.zip")
+    with open(f"{local_path}.part", 'wb') as f:
+        f.write(body[:7000])
+    with open(f"{local_path}.meta.json", 'w', encoding='utf-8') as f:
+        json.dump({'etag': '"v1"', 'last_modified': LAST_MODIFIED}, f)
+
+    assert downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path) == 'baixado'
+
+    assert StandIn.requests_seen[-1]['Range'] == 'bytes=7000-'
+    assert StandIn.requests_seen[-1]['If-Range'] == '"v1"'
+    with open(local_path, 'rb') as f:
+        assert f.read() == body
+    assert not os.path.exists(f"{local_path}.part")
+
+def test_not_modified_reuses_meta_validators(server, session, tmp_path):
+    body = make_zip(b"b" * 100)
+    StandIn.files['/2025/1T2025.zip'] = (body, '"v1"')
+    local_path = str(tmp_path / "1T2025.zip")
+    url = f"{server}/2025/1T2025.zip"
+    downloader.download_file(session, url, local_path)
+    mtime = os.path.getmtime(local_path)
+
+    assert downloader.download_file(session, url, local_path) == 'inalterado'
+
+    assert StandIn.requests_seen[-1]['If-None-Match'] == '"v1"'
+    assert StandIn.requests_seen[-1]['If-Modified-Since'] == LAST_MODIFIED
+    assert os.path.getmtime(local_path) == mtime
+
+def test_missing_quarter_is_unavailable(server, session, tmp_path):
+    status = downloader.fetch_quarter(session, 2025, 1, base_url=server, output_dir=str(tmp_path))
+
+    assert status == 'indisponivel'
+    assert os.listdir(tmp_path) == []
+
+def test_changed_validator_restarts_download(server, session, tmp_path):
+    body = make_zip(os.urandom(10000))
+    StandIn.files['/2025/1T2025.zip'] = (body, '"v2"')
+    local_path = str(tmp_path / "1T2025.zip")
+    with open(f"{local_path}.part", 'wb') as f:
+        f.write(b"conteudo da versao antiga")
+    with open(f"{local_path}.meta.json", 'w', encoding='utf-8') as f:
+        json.dump({'etag': '"v1"', 'last_modified': None}, f)
+
+    assert downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path) == 'baixado'
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == body
+    with open(f"{local_path}.meta.json", encoding='utf-8') as f:
+        assert json.load(f)['etag'] == '"v2"'
+
+def test_range_not_satisfiable_restarts_download(server, session, tmp_path):
+    body = make_zip(b"c" * 3000)
+    StandIn.files['/2025/1T2025.zip'] = (body, '"v1"')
+    StandIn.force_416 = True
+    local_path = str(tmp_path / "1T2025.zip")
+    with open(f"{local_path}.part", 'wb') as f:
+        f.write(body + b"lixo")
+
+    assert downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path) == 'baixado'
+
+    assert 'Range' not in StandIn.requests_seen[-1]
+    with open(local_path, 'rb') as f:
+        assert f.read() == body
+
+def test_corrupted_download_leaves_no_partial_file(server, session, tmp_path):
+    StandIn.files['/2025/1T2025.zip'] = (b"isto nao e um zip", '"v1"')
+    local_path = str(tmp_path / "1T2025.zip")
+
+    with pytest.raises(ValueError):
+        downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path)
+
+    assert not os.path.exists(local_path)
+    assert not os.path.exists(f"{local_path}.part")
+
+def test_interrupted_download_keeps_previous_file(server, session, tmp_path):
+    old_body = make_zip(b"versao antiga")
+    local_path = str(tmp_path / "1T2025.zip")
+    with open(local_path, 'wb') as f:
+        f.write(old_body)
+
+    StandIn.files['/2025/1T2025.zip'] = (make_zip(os.urandom(50000)), '"v2"')
+    StandIn.truncate_after = 1000
+
+    with pytest.raises(requests.exceptions.RequestException):
+        downloader.download_file(session, f"{server}/2025/1T2025.zip", local_path)
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == old_body
+    assert os.path.getsize(f"{local_path}.part") <= 1000
+
+def test_fetch_quarter_reports_interrupted_download(server, session, tmp_path):
+    StandIn.files['/2025/1T2025.zip'] = (make_zip(os.urandom(50000)), '"v1"')
+    StandIn.truncate_after = 1000
+
+    assert downloader.fetch_quarter(session, 2025, 1, base_url=server, output_dir=str(tmp_path)) == 'erro'
+    assert not os.path.exists(tmp_path / "2025" / "Q1" / "1T2025.zip")
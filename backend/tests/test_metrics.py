@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+import metrics
+
+def busy(segundos):
+    fim = time.perf_counter() + segundos
+    while time.perf_counter() < fim:
+        pass
+
+def test_flagged_rows_are_not_dropped():
+    registro = metrics.new_record(etapa='enrich')
+    with metrics.measured(registro):
+        metrics.count_dropped('duplicados', 2)
+        metrics.count_flagged('sem_cadastro', 5)
+
+    assert registro['descartes'] == {'duplicados': 2}
+    assert registro['contadores'] == {'sem_cadastro': 5}
+
+def test_cpu_time_excludes_concurrent_threads():
+    registro = metrics.new_record(etapa='cadop')
+    outra = threading.Thread(target=busy, args=(0.5,))
+    with metrics.measured(registro):
+        outra.start()
+        time.sleep(0.5)
+        outra.join()
+
+    assert registro['cpu_segundos'] < 0.2
+
+def test_overlapping_stages_are_marked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    iniciou = threading.Event()
+    liberar = threading.Event()
+
+    @metrics.instrumented('download')
+    def download():
+        iniciou.set()
+        liberar.wait(5)
+
+    @metrics.instrumented('cadop')
+    def cadop():
+        liberar.set()
+
+    thread = threading.Thread(target=download)
+    thread.start()
+    iniciou.wait(5)
+    cadop()
+    thread.join()
+
+    @metrics.instrumented('process')
+    def process():
+        pass
+    process()
+
+    assert metrics.load_stage('download')['etapas_simultaneas'] == ['cadop']
+    assert metrics.load_stage('cadop')['etapas_simultaneas'] == ['download']
+    assert metrics.load_stage('process')['etapas_simultaneas'] == []
+    texto = metrics.prometheus_text([metrics.load_stage(s) for s in ('download', 'cadop', 'process')])
+    assert 'ans_etl_stage_peak_rss_bytes{stage="process"}' in texto
+    assert 'ans_etl_stage_peak_rss_bytes{stage="download"}' not in texto
+    assert metrics.load_stage('download')['pico_rss_mb'] is None
+
+needs_reset = pytest.mark.skipif(not metrics.reset_peak_rss(), reason="sem /proc/self/clear_refs")
+
+@needs_reset
+def test_peak_rss_is_per_stage():
+    pesada = metrics.new_record(etapa='pesada')
+    with metrics.measured(pesada):
+        bloco = bytearray(200 * 1024 * 1024)
+        bloco[::4096] = b'x' * len(bloco[::4096])
+        del bloco
+    leve = metrics.new_record(etapa='leve')
+    with metrics.measured(leve):
+        pass
+
+    assert pesada['pico_rss_mb'] - leve['pico_rss_mb'] > 150
+
+@needs_reset
+def test_stage_peak_includes_members():
+    etapa = metrics.new_record(etapa='process')
+    with metrics.measured(etapa):
+        with metrics.track_member('1T2025.csv') as membro:
+            bloco = bytearray(200 * 1024 * 1024)
+            bloco[::4096] = b'x' * len(bloco[::4096])
+            del bloco
+        metrics.merge_member(membro)
+        with metrics.track_member('2T2025.csv') as segundo:
+            pass
+        metrics.merge_member(segundo)
+
+    assert membro['pico_rss_mb'] - segundo['pico_rss_mb'] > 150
+    assert etapa['pico_rss_mb'] >= membro['pico_rss_mb']
@@ -0,0 +1,35 @@
+import os
+
+import run_pipeline
+
+def test_fingerprint_resolves_scripts_outside_backend(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(run_pipeline.RAW_DIR)
+    stage = run_pipeline.STAGES['process']
+
+    assert run_pipeline.fingerprint(stage) is not None
+
+def test_missing_input_is_never_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stage = run_pipeline.STAGES['enrich']
+    os.makedirs(os.path.dirname(stage.outputs[0]), exist_ok=True)
+    open(stage.outputs[0], 'w').close()
+
+    assert run_pipeline.fingerprint(stage) is None
+    assert not run_pipeline.is_up_to_date(stage, {'fingerprint': None})
+    assert not run_pipeline.is_up_to_date(stage, {})
+
+def test_changed_input_is_stale(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stage = run_pipeline.STAGES['process']
+    os.makedirs(os.path.join(run_pipeline.RAW_DIR, "2025", "Q1"))
+    os.makedirs(run_pipeline.STAGING_DIR)
+    entrada = os.path.join(run_pipeline.RAW_DIR, "2025", "Q1", "1T2025.zip")
+    with open(entrada, 'wb') as f:
+        f.write(b"v1")
+    estado = {'fingerprint': run_pipeline.fingerprint(stage)}
+
+    assert run_pipeline.is_up_to_date(stage, estado)
+    with open(entrada, 'wb') as f:
+        f.write(b"versao 2")
+    assert not run_pipeline.is_up_to_date(stage, estado)
@@ -0,0 +1,91 @@
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+import metrics
+import process_data
+
+HEADER = "DATA;REG_ANS;CD_CONTA_CONTABIL;DESCRICAO;VL_SALDO_INICIAL;VL_SALDO_FINAL\n"
+
+def write_zip(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(os.path.basename(path).replace('.zip', '.csv'), HEADER + "".join(rows))
+
+@pytest.fixture
+def raw_data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_zip(os.path.join(process_data.RAW_DIR, "2025", "Q1", "1T2025.zip"), [
+        "2025-03-31;300001;411;EVENTOS CONHECIDOS;0;100,00\n",
+        "2025-03-31;300001;4111;EVENTOS MEDICO-HOSPITALARES;0;60,00\n",
+    ])
+    write_zip(os.path.join(process_data.RAW_DIR, "2025", "Q2", "2T2025.zip"), [
+        "2025-06-30;300001;411;EVENTOS CONHECIDOS;0;150,00\n",
+        "2025-06-30;300002;41;EVENTOS INDENIZAVEIS;0;1.350,50\n",
+        "2025-06-30;300002;4112;EVENTOS INDENIZAVEIS;0;1.200,50\n",
+    ])
+
+def test_parse_currency_flags_malformed_values():
+    valores = pd.Series(['1.200,50', 'R$ 3,00', 'abc', '1,2,3', 'R$ x', None])
+
+    parsed, invalidos = process_data.parse_currency(valores)
+
+    assert parsed[:2].tolist() == [1200.50, 3.0]
+    assert invalidos.tolist() == [False, False, True, True, True, False]
+
+def test_invalid_values_are_dropped_and_counted():
+    df = pd.DataFrame({
+        'REG_ANS': [300001, 300001, 300001], 'CD_CONTA_CONTABIL': ['4111', '4112', '4113'],
+        'DESCRICAO': ['EVENTOS'] * 3, 'VL_SALDO_FINAL': ['1.200,50', 'abc', '1,2,3'], 'DATA': ['2025-03-31'] * 3,
+    })
+    registro = metrics.new_record(etapa='process')
+
+    with metrics.measured(registro):
+        out = process_data.transform_dataframe(df, 'raw')
+
+    assert out['ValorDespesas'].tolist() == [1200.50]
+    assert registro['descartes']['valor_invalido'] == 2
+    assert registro['linhas_saida'] == 1
+
+def staged_rows():
+    frames = [pd.read_csv(os.path.join(process_data.STAGING_DIR, name), dtype={'Conta': str})
+              for name in sorted(os.listdir(process_data.STAGING_DIR))]
+    return pd.concat(frames).sort_values(['Trimestre', 'RegistroANS', 'Conta']).reset_index(drop=True)
+
+def test_account_index_uses_union_of_members(raw_data):
+    results = process_data.main(workers=1, chunksize=0, incremental=False)
+
+    indices = process_data.zip_index(process_data.list_members(), results)
+    assert process_data.contas_sinteticas(set().union(*(e['contas'] for e in indices.values()))) == {'41', '411'}
+
+@pytest.mark.parametrize("chunksize", [0, 1])
+def test_synthetic_accounts_removed_across_files(raw_data, chunksize):
+    process_data.main(workers=1, chunksize=chunksize, incremental=False)
+
+    rows = staged_rows()
+    assert rows['Conta'].tolist() == ['4111', '4112']
+    assert rows['ValorDespesas'].tolist() == [60.0, 1200.50]
+
+def test_process_pool_receives_run_index(raw_data):
+    process_data.main(workers=2, chunksize=0, incremental=False)
+
+    assert staged_rows()['Conta'].tolist() == ['4111', '4112']
+
+@pytest.mark.parametrize("chunksize", [0, 1])
+def test_incremental_run_matches_full_run(raw_data, chunksize):
+    q2 = os.path.join(process_data.RAW_DIR, "2025", "Q2", "2T2025.zip")
+    process_data.main(workers=1, chunksize=chunksize, incremental=True)
+
+    for rows, contas in [
+        (["2025-06-30;300002;41111;EVENTOS INDENIZAVEIS;0;150,00\n"], ['41111']),
+        (["2025-06-30;300002;4112;EVENTOS INDENIZAVEIS;0;150,00\n"], ['4111', '4112']),
+    ]:
+        write_zip(q2, rows)
+        process_data.main(workers=1, chunksize=chunksize, incremental=True)
+        incremental = staged_rows()
+
+        process_data.main(workers=1, chunksize=chunksize, incremental=False)
+        assert incremental['Conta'].tolist() == contas
+        pd.testing.assert_frame_equal(incremental, staged_rows())
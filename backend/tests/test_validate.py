@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from schema import apply_schema
+from validate_data import validate_frame, validate_row
+
+CNPJS = [
+    '11222333000181', '11.222.333/0001-81', '11222333000182', '00000000000000', '11111111111111',
+    '1222333000181', '01222333000128', '1222333000128', '112223330001810', '', ' ', None, np.nan, 'nan',
+    'abc', 11222333000181, 11222333000181.0, '١١٢٢٢٣٣٣٠٠٠١٨١',
+]
+VALORES = [
+    '100', '100.50', '0', '-5', '1e3', 'inf', '-inf', 'Infinity', 'nan', 'NaN', '1_000', ' 12 ', '1,5',
+    'R$ 10', '', 'abc', '0x10', None, np.nan, 10, -1.5, 0.0, float('inf'), True,
+]
+RAZOES = ['OPERADORA SA', '', '   ', None, np.nan, 'nan']
+
+def reference(df):
+    return df.apply(validate_row, axis=1)
+
+def combinations():
+    linhas = [(cnpj, valor, RAZOES[i % len(RAZOES)]) for i, cnpj in enumerate(CNPJS) for valor in VALORES[:3]]
+    linhas += [(CNPJS[i % len(CNPJS)], valor, razao) for i, valor in enumerate(VALORES) for razao in RAZOES]
+    return pd.DataFrame(linhas, columns=['CNPJ', 'ValorDespesas', 'RazaoSocial'], dtype=object)
+
+def test_matches_row_validator_on_raw_values():
+    df = combinations()
+
+    assert validate_frame(df).tolist() == reference(df).tolist()
+
+@pytest.mark.parametrize("dtype", ['string', 'category'])
+def test_matches_row_validator_on_typed_columns(dtype):
+    df = combinations()
+    df['CNPJ'] = df['CNPJ'].map(lambda v: v if isinstance(v, str) else None).astype(dtype)
+    df['RazaoSocial'] = df['RazaoSocial'].astype('string')
+
+    assert validate_frame(df).tolist() == reference(df).tolist()
+
+def test_matches_row_validator_after_schema():
+    df = combinations().rename(columns={'ValorDespesas': 'Valor'})
+    df['ValorDespesas'] = pd.to_numeric(df['Valor'], errors='coerce')
+    df = apply_schema(df.drop(columns='Valor'))
+
+    assert validate_frame(df).tolist() == reference(df).tolist()
+
+def test_padded_cnpj_is_checked_after_schema():
+    df = apply_schema(pd.DataFrame({'CNPJ': ['1222333000128'], 'ValorDespesas': [10.0], 'RazaoSocial': ['X']}))
+
+    assert df['CNPJ'].astype(str).tolist() == ['01222333000128']
+    assert validate_frame(df).tolist() == reference(df).tolist() == ['VALIDO']
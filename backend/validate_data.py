@@ -1,8 +1,16 @@
+import os
+import numpy as np
 import pandas as pd
 import re
+from storage import frame_exists, frame_path, write_frame
+from schema import read_typed
+from metrics import count_rows, instrumented
 
-INPUT_FILE = "consolidado_despesas.csv"
-OUTPUT_FILE = "consolidado_despesas_validado.csv"
+INPUT_FILE = os.path.join("output", "consolidado_despesas_enriquecido.csv")
+OUTPUT_FILE = os.path.join("output", "consolidado_despesas_validado.csv")
+
+CNPJ_WEIGHTS1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+CNPJ_WEIGHTS2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
 
 def is_valid_cnpj(cnpj):
     cnpj = re.sub(r'[^0-9]', '', str(cnpj))
@@ -44,15 +52,74 @@ def validate_row(row):
         
     return ';'.join(issues) if issues else 'VALIDO'
 
-def main():
+def check_digits(matrix):
+    def calculate_digit(weights, body):
+        rem = body @ weights % 11
+        return np.where(rem < 2, 0, 11 - rem)
+
+    digit1 = calculate_digit(CNPJ_WEIGHTS1, matrix[:, :12])
+    digit2 = calculate_digit(CNPJ_WEIGHTS2, np.column_stack([matrix[:, :12], digit1]))
+    return (matrix[:, 12] == digit1) & (matrix[:, 13] == digit2)
+
+def valid_cnpj_mask(cnpjs):
+    digits = cnpjs.astype('string').fillna('').str.replace(r'[^0-9]', '', regex=True)
+    mask = (digits.str.len() == 14).to_numpy(copy=True)
+
+    if mask.any():
+        matrix = np.frombuffer(''.join(digits[mask]).encode('ascii'), dtype=np.uint8).reshape(-1, 14).astype(np.int64) - 48
+        repeated = (matrix == matrix[:, :1]).all(axis=1)
+        mask[mask] = check_digits(matrix) & ~repeated
+
+    return pd.Series(mask, index=cnpjs.index)
+
+def to_float(value):
     try:
-        df = pd.read_csv(INPUT_FILE, dtype={'CNPJ': str})
-    except FileNotFoundError:
+        return float(value)
+    except:
+        return None
+
+def parse_values(values):
+    valores = pd.to_numeric(values, errors='coerce').astype(float)
+    valor_invalido = pd.Series(False, index=values.index)
+    faltantes = valores.isna()
+    if faltantes.any():
+        convertidos = [to_float(v) for v in values[faltantes]]
+        valor_invalido[faltantes] = [v is None for v in convertidos]
+        valores[faltantes] = [np.nan if v is None else v for v in convertidos]
+    return valores, valor_invalido
+
+def validate_frame(df):
+    valores, valor_invalido = parse_values(df['ValorDespesas'])
+    razao = df['RazaoSocial']
+
+    checks = [
+        (~valid_cnpj_mask(df['CNPJ']), 'CNPJ_INVALIDO'),
+        (valores <= 0, 'VALOR_NAO_POSITIVO'),
+        (valor_invalido, 'VALOR_INVALIDO'),
+        (razao.isna() | (razao.astype(str).str.strip() == ''), 'RAZAO_SOCIAL_VAZIA'),
+    ]
+
+    status = pd.Series('', index=df.index, dtype=object)
+    for mask, code in checks:
+        status = status.mask(mask, status + code + ';')
+
+    status = status.str[:-1]
+    return status.mask(status == '', 'VALIDO')
+
+@instrumented("validate")
+def main():
+    if not frame_exists(INPUT_FILE):
+        print(f"Erro: {frame_path(INPUT_FILE)} nao encontrado.")
         return
 
-    df['StatusValidacao'] = df.apply(validate_row, axis=1)
+    df = read_typed(INPUT_FILE)
+    count_rows(entrada=len(df))
+
+    df['StatusValidacao'] = validate_frame(df)
     
-    df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
+    out_path = write_frame(df, OUTPUT_FILE)
+    count_rows(saida=len(df))
+    print(f"Validado: {out_path} ({(df['StatusValidacao'] != 'VALIDO').sum()} registro(s) com problemas)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
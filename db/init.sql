@@ -1,25 +1,40 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
 DROP TABLE IF EXISTS despesas CASCADE;
 DROP TABLE IF EXISTS operadoras CASCADE;
 DROP TABLE IF EXISTS despesas_agregadas CASCADE;
+DROP TABLE IF EXISTS controle_carga CASCADE;
 
 CREATE TABLE IF NOT EXISTS operadoras (
     registro_ans INT PRIMARY KEY,
-    cnpj VARCHAR(20),
+    cnpj VARCHAR(20), -- 14 digitos com zeros a esquerda (carga incremental corrige linhas antigas com LPAD)
     razao_social VARCHAR(255),
     modalidade VARCHAR(100),
     uf VARCHAR(50)
 );
 
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_operadoras_razao_social_trgm ON operadoras USING gin (f_unaccent(razao_social) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_operadoras_cnpj_trgm ON operadoras USING gin (cnpj gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_operadoras_cnpj_prefixo ON operadoras (cnpj text_pattern_ops);
+
 CREATE TABLE IF NOT EXISTS despesas (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     registro_ans INT,
-    trimestre DATE,
+    trimestre DATE NOT NULL,
     ano INT,
     conta VARCHAR(50),
     descricao VARCHAR(255),
     valor_despesas DECIMAL(15,2),
+    PRIMARY KEY (id, trimestre),
     FOREIGN KEY (registro_ans) REFERENCES operadoras(registro_ans)
-);
+) PARTITION BY RANGE (trimestre);
+
+CREATE INDEX IF NOT EXISTS idx_despesas_registro_ans_trimestre ON despesas (registro_ans, trimestre);
 
 CREATE TABLE IF NOT EXISTS despesas_agregadas (
     id SERIAL PRIMARY KEY,
@@ -28,4 +43,29 @@ CREATE TABLE IF NOT EXISTS despesas_agregadas (
     total_despesas DECIMAL(15,2),
     media_trimestral DECIMAL(15,2),
     desvio_padrao DECIMAL(15,2)
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS idx_despesas_agregadas_total ON despesas_agregadas (total_despesas DESC);
+
+CREATE TABLE IF NOT EXISTS controle_carga (
+    id SMALLINT PRIMARY KEY,
+    geracao BIGINT NOT NULL,
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_despesas_operadora_trimestre AS
+    SELECT registro_ans, trimestre, SUM(valor_despesas) AS total_despesas, COUNT(*) AS qtd_lancamentos
+    FROM despesas
+    GROUP BY registro_ans, trimestre;
+CREATE UNIQUE INDEX IF NOT EXISTS mv_despesas_operadora_trimestre_key ON mv_despesas_operadora_trimestre (registro_ans, trimestre);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_despesas_uf AS
+    SELECT o.uf, SUM(d.valor_despesas) AS despesas_totais, COUNT(DISTINCT d.registro_ans) AS qtd_operadoras
+    FROM despesas d
+    JOIN operadoras o ON d.registro_ans = o.registro_ans
+    GROUP BY o.uf;
+CREATE UNIQUE INDEX IF NOT EXISTS mv_despesas_uf_key ON mv_despesas_uf (uf);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_estatisticas AS
+    SELECT 1 AS id, SUM(valor_despesas) AS total_despesas, AVG(valor_despesas) AS media_despesas, COUNT(*) AS qtd_despesas
+    FROM despesas;
+CREATE UNIQUE INDEX IF NOT EXISTS mv_estatisticas_key ON mv_estatisticas (id);
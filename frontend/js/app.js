@@ -12,7 +12,9 @@ createApp({
         const currentView = ref('lista');
         const selectedOperadora = ref(null);
         const despesasHistorico = ref([]);
+        const sugestoes = ref([]);
         let chartInstance = null;
+        let sugestoesTimer = null;
 
         const fetchOperadoras = async (p = 1) => {
             loading.value = true;
@@ -31,6 +33,23 @@ createApp({
             }
         };
 
+        const buscarSugestoes = () => {
+            clearTimeout(sugestoesTimer);
+            const termo = searchQuery.value.trim();
+            if (termo.length < 2) {
+                sugestoes.value = [];
+                return;
+            }
+            sugestoesTimer = setTimeout(async () => {
+                try {
+                    const res = await fetch(`${API_URL}/operadoras/autocomplete?q=${encodeURIComponent(termo)}&limit=8`);
+                    if (res.ok) sugestoes.value = await res.json();
+                } catch (e) {
+                    console.error(e);
+                }
+            }, 150);
+        };
+
         const verDetalhes = async (cnpj) => {
             if (!cnpj) return;
             loading.value = true;
@@ -90,8 +109,8 @@ createApp({
 
         return {
             operadoras, stats, page, totalPages, loading, searchQuery, currentView,
-            selectedOperadora, despesasHistorico,
-            fetchOperadoras, verDetalhes, loadDashboard, formatMoney
+            selectedOperadora, despesasHistorico, sugestoes,
+            fetchOperadoras, buscarSugestoes, verDetalhes, loadDashboard, formatMoney
         };
     }
 }).mount('#app');
\ No newline at end of file